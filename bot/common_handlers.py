@@ -2,6 +2,7 @@
 
 import logging
 import html
+import secrets
 import json
 import traceback
 
@@ -10,7 +11,8 @@ from telegram.ext import ConversationHandler
 from telegram.constants import ParseMode
 
 from . import main_menu, LOCALES, TEMPLATE_IDS
-from .util import CustomContext, clear_output
+from .util import CustomContext
+from .scheduler import SCHEDULER
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +24,9 @@ async def begin(update: Update, context: CustomContext):
 
     await context.saved_message('main_menu').create(LOCALES['loading'])
 
-    context.task = {'variants': 1, 'name': '', 'description': '', 'examples': []}
+    # work_id отличает эту работу от других с теми же параметрами: повторная генерация именно её отдаётся из кэша
+    context.task = {'variants': 1, 'name': '', 'description': '', 'examples': [], 'seed': None,
+                    'work_id': secrets.token_hex(8)}
     context.eq_names = TEMPLATE_IDS.copy()
     context.selected_example = 0
     context.eq_page = 0
@@ -55,9 +59,10 @@ async def cancel(update: Update, context: CustomContext):
     await context.saved_message('main_menu').delete()
     await context.saved_message('input').delete()
 
-    # на случай, если уже добавил кастомный шаблон, мы его всё равно удалим
-    clear_output(context.task['name'], str(update.effective_user.id))
+    # останавливаем генерацию работы, если она идёт или ждёт в очереди
+    SCHEDULER.cancel(str(update.effective_user.id))
 
+    # загруженные кастомные шаблоны больше ни на что не ссылаются, их удалит сборщик мусора (см. collect_garbage)
     context.user_data.clear()
 
     return ConversationHandler.END
@@ -1,18 +1,15 @@
 """Меню №3: выбор/загрузка шаблонов уравнений"""
 
-import sympy as sp
-import yamale
 from telegram import Update, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from pathlib import Path
 
+from gen import validation
 from .util import answer_query, handle_input, make_button, remove_alarm, clear, CustomContext
 from . import EQUATIONS_MENU, EQUATIONS_NEXT, EQUATIONS_PREVIOUS, EQUATIONS_UPLOAD, EQUATIONS_SELECT_1, \
     EQUATIONS_SELECT_2, EQUATIONS_SELECT_3, EQUATIONS_SELECT_4, EQUATIONS_BACK_TO_EX, EQUATIONS_UPLOAD_INPUT, \
     EQUATIONS_UPLOAD_INPUT_2, LOCALES, examples_menu, TEMPLATE_IDS
 
-SCHEMA = yamale.make_schema("data/equations/schema.yaml")
-
 # распределяем уравнения (т.е. пары айди - название) по страницам, 4 штуки на каждую, и сохраняем в equations
 items = list(TEMPLATE_IDS.items())
 equations = {}
@@ -108,7 +105,7 @@ async def continue_upload(update: Update, context: CustomContext):
 # вместо удаления запроса меняем его текст
 @handle_input(continue_upload, equations_upload, file=True, edit_text=LOCALES['upload_2'])
 async def equations_upload_input(update: Update, context: CustomContext, file):
-    """Загрузить файл шаблона на диск и проверить его на ошибки"""
+    """Загрузить файл шаблона на диск и проверить его на ошибки (в отдельном процессе, см. gen.validation)"""
 
     file_id = file.file_unique_id
     user_id = str(update.effective_user.id)
@@ -116,27 +113,25 @@ async def equations_upload_input(update: Update, context: CustomContext, file):
 
     # если папки с шаблонами пользователя ещё нет, создать таковую
     path = Path(f"data/equations/custom/{user_id}")
-    path.mkdir(exist_ok=True)
+    path.mkdir(parents=True, exist_ok=True)
 
     file_path = path / f"{file_id}.yaml"
 
     await file.download_to_drive(file_path)  # скачиваем файл с серверов телеграма
 
-    try:
-        data = yamale.make_data(f"data/equations/custom/{user_id}/{file_id}.yaml")
-        yamale.validate(SCHEMA, data)  # проверка структуры файла (разметка, типы данных etc.) на соответствие схеме
-
-        # здесь отдельно проверяем, что семпай может обработать указанную в шаблоне форму уравнения
-        for f in data[0][0]['form']:
-            eq_text = f.split("=")
-            sp.sympify(eq_text[0])
-            sp.sympify(eq_text[1])
-    except:
-        # если произошла ошибка, отправляем 3-секундное сообщение о ней пользователю, удаляем файл
-        # и возвращаемся в меню заданий
-        msg = await context.bot.send_message(chat_id=chat_id, text=LOCALES['upload_error'], parse_mode=ParseMode.MARKDOWN)
+    # проверка структуры по схеме, разбор форм и пробное решение идут в отдельном процессе с лимитами,
+    # а бот тем временем обслуживает остальных пользователей
+    await context.saved_message('input').edit(LOCALES['upload_checking'])
+    verdict = await validation.validate_template(file_path)
+
+    if not verdict.ok:
+        # если шаблон не прошёл проверку, отправляем 3-секундное сообщение об этом пользователю, удаляем файл
+        # и снова запрашиваем шаблон
+        text = LOCALES['upload_slow'] if verdict.reason in validation.TOO_SLOW else LOCALES['upload_error']
+        msg = await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN)
         context.job_queue.run_once(remove_alarm, 3, chat_id=chat_id, name=user_id, data=[chat_id, msg.message_id])
         file_path.unlink()
+        await context.saved_message('input').delete()
 
         return False
 
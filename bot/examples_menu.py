@@ -27,7 +27,7 @@ async def examples_menu_handler(update: Update, context: CustomContext):
 
     if context.has_examples:
         n = 0
-        for ex_id, ex_amount in context.task['examples']:
+        for ex_id, ex_amount, *_ in context.task['examples']:  # третий элемент - фильтры (см. gen.sampling)
             ex_name = context.eq_names[ex_id]  # тривиальное название шаблона
 
             # выбираем ключ к локализации в зависимости от того, выбрано сейчас данное задание или нет
@@ -99,13 +99,13 @@ async def examples_edit_input(update: Update, context: CustomContext, text: str)
     """Проверить пользовательский ввод и сохранить полученное кол-во уравнений"""
 
     sel = context.selected_example
-    name = context.task['examples'][sel][0]  # получаем название старого шаблона (оно таким и останется)
+    name, _, *filters = context.task['examples'][sel]  # название старого шаблона и фильтры останутся такими же
 
     # требования к вводу - натуральное число, меньшее либо равное 50
     try:
         amount = int(text)
         if isNaturalNumber(amount) and amount <= 50:
-            context.task['examples'][sel] = (name, amount)  # пихаем по выделенному индексу новый кортеж имя-количество
+            context.task['examples'][sel] = (name, amount, *filters)  # пихаем по выделенному индексу новый кортеж
         else:
             raise ValueError  # всё равно кидаем исключение, когда число слишком большое
         return True  # возвращаемся в меню заданий
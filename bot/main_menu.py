@@ -1,15 +1,25 @@
 """Меню №1: основные настройки и генерация проверочной работы"""
 
+import copy
 import asyncio
-from telegram import Update, InlineKeyboardMarkup
+import logging
+from contextlib import aclosing
+from telegram import Update, InlineKeyboardMarkup, Message, InputMediaDocument
 from telegram.ext import ConversationHandler
 from telegram.constants import ParseMode
 from is_natural_number import isNaturalNumber
 
-from gen import task
+from gen import task, jobs, metrics, CONFIG
+from gen.sampling import PoolExhausted
+from .scheduler import SCHEDULER, QueueFull, Job
 from . import NAME, DESCRIPTION, VARIANTS, EXAMPLES, READY_WARNING, CREATE, MAIN_MENU, VARIANTS_INPUT, \
     NAME_INPUT, DESCRIPTION_INPUT, LOCALES
-from .util import handle_input, answer_query, make_button, clear, remove_alarm, CustomContext, clear_output
+from .util import handle_input, answer_query, make_button, clear, remove_alarm, CustomContext
+
+# где генерируются работы: в процессе бота или во внешних воркерах через очередь (у модулей одинаковые stream/generate)
+GENERATOR = jobs if CONFIG['workers']['queue'] else task
+
+logger = logging.getLogger(__name__)
 
 
 @answer_query
@@ -106,6 +116,66 @@ async def description_input(update: Update, context: CustomContext, text):
     return True
 
 
+async def wait_for_job(job: Job, msg: Message, owns_message: bool = True):
+    """Дождаться результата работы, периодически обновляя сообщение об ожидании местом в очереди
+
+    Если owns_message=False, после запуска работы сообщение не трогается (его обновляет сама работа)."""
+
+    shown = LOCALES['please_wait']
+    while not job.done():
+        if job.started and not owns_message:
+            await asyncio.wait([job.future])
+            break
+        if job.started:
+            text = LOCALES['please_wait']
+        else:
+            text = LOCALES['queue_position'].format(SCHEDULER.position(job), SCHEDULER.eta(job))
+        if text != shown:
+            await msg.edit_text(text=text, parse_mode=ParseMode.MARKDOWN)
+            shown = text
+        await asyncio.wait([job.future], timeout=CONFIG['scheduler']['update_interval'])
+
+    return job.future.result()
+
+
+async def send_pdfs(context: CustomContext, chat_id: int, pdfs: list[tuple[str, bytes]]) -> None:
+    """Отправить готовые pdf (пары имя файла, содержимое) одним сообщением (альбомом, если их несколько)"""
+    with metrics.span('upload'):
+        if len(pdfs) == 1:
+            filename, data = pdfs[0]
+            await context.bot.send_document(chat_id=chat_id, document=data, filename=filename)
+        else:
+            await context.bot.send_media_group(chat_id=chat_id, media=[
+                InputMediaDocument(data, filename=filename) for filename, data in pdfs])
+
+
+async def stream_task(context: CustomContext, chat_id: int, msg: Message, task_conf: dict,
+                      user_id: str) -> task.Result:
+    """Создать работу, отправляя варианты и ответы по мере компиляции и показывая прогресс в сообщении msg"""
+
+    total = task_conf['variants'] + 1
+    group_size = min(CONFIG['delivery']['group_size'], 10)  # в альбоме телеграма не больше 10 файлов
+    result = task.Result()
+    ready: list[tuple[str, bytes]] = []
+    done = 0
+
+    await msg.edit_text(text=LOCALES['progress'].format(done, total), parse_mode=ParseMode.MARKDOWN)
+    # aclosing - чтобы при отмене генерация останавливалась сразу, а не когда генератор соберёт сборщик мусора
+    async with aclosing(GENERATOR.stream(task_conf, user_id, result)) as pdfs:
+        async for pdf in pdfs:
+            ready.append(pdf)
+            done += 1
+            if len(ready) >= group_size:
+                await send_pdfs(context, chat_id, ready)
+                ready = []
+            await msg.edit_text(text=LOCALES['progress'].format(done, total), parse_mode=ParseMode.MARKDOWN)
+
+    if ready:
+        await send_pdfs(context, chat_id, ready)
+
+    return result
+
+
 @answer_query
 async def generate(update: Update, context: CustomContext):
     """Создать новую проверочную работу по нажатию кнопки 'Готово'"""
@@ -121,22 +191,63 @@ async def generate(update: Update, context: CustomContext):
     msg = await context.bot.send_message(chat_id=chat_id, text=LOCALES['please_wait'],
                                          parse_mode=ParseMode.MARKDOWN)  # сообщение "пожалуйста, подождите..."
 
-    # в отдельном треде (в целях асинхронности) запускаем генерацию работы и ждём результата
-    await asyncio.to_thread(task.generate, context.task, user_id)
+    # ставим генерацию работы в общую очередь и ждём результата, показывая место в очереди;
+    # в потоковом режиме варианты отправляются сразу по готовности, не дожидаясь остальных
+    streaming = CONFIG['delivery']['stream']
+    try:
+        if streaming:
+            job = SCHEDULER.submit(user_id, stream_task, context, chat_id, msg, copy.deepcopy(context.task), user_id)
+        else:
+            job = SCHEDULER.submit(user_id, GENERATOR.generate, copy.deepcopy(context.task), user_id)
+        result = await wait_for_job(job, msg, owns_message=not streaming)
+    except QueueFull:
+        await msg.edit_text(text=LOCALES['queue_full'], parse_mode=ParseMode.MARKDOWN)
+        context.job_queue.run_once(remove_alarm, 5, chat_id=chat_id, name=user_id, data=[chat_id, msg.message_id])
+        context.is_generating = False
+        return await main_menu_handler(update, context)
+    except asyncio.CancelledError:
+        # пользователь вышел из меню через /cancel, всё остальное уже почистил обработчик отмены
+        await msg.delete()
+        return ConversationHandler.END
+    except PoolExhausted as e:
+        # шаблону не хватило различных уравнений, сообщаем об этом и возвращаемся в главное меню
+        await msg.edit_text(text=LOCALES['pool_exhausted'].format(context.eq_names[e.eq_id], e.available),
+                            parse_mode=ParseMode.MARKDOWN)
+        context.job_queue.run_once(remove_alarm, 5, chat_id=chat_id, name=user_id, data=[chat_id, msg.message_id])
+        context.is_generating = False
+        return await main_menu_handler(update, context)
+    except Exception:
+        # генерация упала (ошибка в шаблоне, компиляции, воркере): иначе кнопка "Готово" осталась бы заблокированной
+        logger.exception(f"Failed to generate task for user {user_id}")
+        context.is_generating = False
+        await msg.edit_text(text=LOCALES['generation_failed'], parse_mode=ParseMode.MARKDOWN)
+        context.job_queue.run_once(remove_alarm, 5, chat_id=chat_id, name=user_id, data=[chat_id, msg.message_id])
+        return await main_menu_handler(update, context)
 
     # удаляем сообщение об ожидании и главное меню
     await msg.delete()
     await context.saved_message('main_menu').delete()
 
-    # новым сообщением отправляем готовый архив из папки zip
-    await context.bot.send_document(chat_id=chat_id,
-                                    document=open(f"out/{user_id}/zip/{context.task['name']}.zip", 'rb'),
-                                    parse_mode=ParseMode.MARKDOWN, caption=LOCALES['ready'])
+    # после потоковой отправки архив нужен, только если он включён в настройках
+    send_zip = not streaming or CONFIG['delivery']['zip']
+
+    # если в каких-то заданиях уравнения повторяются, предупреждаем об этом в подписи к архиву
+    caption = LOCALES['ready'] if send_zip else LOCALES['ready_stream']
+    if result.repeated:
+        caption += LOCALES['pool_repeated'].format(', '.join(context.eq_names[eq_id] for eq_id in result.repeated))
 
-    # чистим оставшиеся после использования бота файлы
-    await asyncio.to_thread(clear_output, context.task['name'], user_id)
+    # новым сообщением отправляем готовый архив (он собран в памяти) либо просто сообщаем, что всё отправлено
+    if send_zip:
+        with metrics.span('upload'):
+            await context.bot.send_document(chat_id=chat_id, document=result.archive,
+                                            filename=f"{context.task['name']}.zip",
+                                            parse_mode=ParseMode.MARKDOWN, caption=caption)
+    else:
+        await context.bot.send_message(chat_id=chat_id, text=caption, parse_mode=ParseMode.MARKDOWN)
 
-    context.is_generating = False
+    # диалог закончен, и новая работа начнётся с чистого листа (см. begin), поэтому данные пользователя
+    # сбрасываем: его кастомные шаблоны больше ни на что не ссылаются, их удалит сборщик мусора (см. collect_garbage)
+    context.user_data.clear()
 
     return ConversationHandler.END
 
@@ -0,0 +1,123 @@
+"""Наблюдение за отзывчивостью бота: время работы хэндлеров и зависания цикла событий
+
+Хэндлеры с декораторами answer_query и handle_input замеряются целиком (вложенные вызовы других хэндлеров
+засчитываются внешнему). Задача-замерщик раз в monitor.lag_interval секунд проверяет, насколько позже положенного
+она проснулась; отдельный тред в это время смотрит, не завис ли цикл, и если завис - снимает стек треда цикла,
+чтобы в лог попал хэндлер и строка кода, на которых всё остановилось."""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+
+from gen import CONFIG, metrics
+
+logger = logging.getLogger(__name__)
+
+ROOT = str(Path(__file__).resolve().parent.parent)
+
+_handlers: dict = {}  # объект кода хэндлера -> его название (чтобы узнать хэндлер по стеку)
+_handler: contextvars.ContextVar[str | None] = contextvars.ContextVar('handler', default=None)
+
+_task: asyncio.Task | None = None
+_thread: threading.Thread | None = None
+_stopped = threading.Event()
+_beat = 0.0  # когда замерщик последний раз проснулся
+_culprit: str | None = None  # где стоял цикл во время текущего зависания (заполняет тред-наблюдатель)
+
+
+def handler_name(func) -> str:
+    """Зарегистрировать хэндлер и вернуть его название для метрик"""
+    name = func.__qualname__.replace('.<locals>', '')
+    _handlers[func.__code__] = name
+    return name
+
+
+@contextmanager
+def handler_span(name: str):
+    """Замерить время работы хэндлера (eqgen_handler_seconds), если он не вызван из другого хэндлера"""
+
+    if _handler.get() is not None:
+        yield
+        return
+
+    token = _handler.set(name)
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('eqgen_handler_seconds', time.perf_counter() - t, handler=name)
+        _handler.reset(token)
+
+
+def _locate(thread_id: int) -> str:
+    """Найти по стеку треда хэндлер и строку кода бота, которые сейчас выполняются"""
+
+    frame = sys._current_frames().get(thread_id)
+    handler, place = None, None
+    while frame is not None:
+        code = frame.f_code
+        if place is None and code.co_filename.startswith(ROOT):
+            place = f"{Path(code.co_filename).relative_to(ROOT)}:{frame.f_lineno} in {code.co_name}"
+        if code in _handlers:
+            handler = _handlers[code]  # идём до самого внешнего, как и в handler_span
+        frame = frame.f_back
+    return f"handler {handler or 'none'} at {place or 'unknown place'}"
+
+
+def _watch(thread_id: int, interval: float, threshold: float) -> None:
+    """Тред-наблюдатель: пока цикл стоит дольше threshold, запомнить, где именно"""
+    global _culprit
+
+    while not _stopped.wait(interval):
+        if _culprit is None and time.monotonic() - _beat - interval > threshold:
+            _culprit = _locate(thread_id)
+
+
+async def _sample(interval: float, threshold: float) -> None:
+    """Замерять задержку цикла событий (eqgen_loop_lag_seconds), о зависаниях писать в лог"""
+    global _beat, _culprit
+
+    while True:
+        t = time.monotonic()
+        await asyncio.sleep(interval)
+        _beat = time.monotonic()
+        lag = _beat - t - interval
+        metrics.observe('eqgen_loop_lag_seconds', lag)
+
+        if lag > threshold:
+            metrics.inc('eqgen_loop_stalls_total')
+            logger.warning(f"Event loop was blocked for {lag:.3f} seconds: {_culprit or 'unknown handler'}")
+        _culprit = None
+
+
+async def start(application=None) -> None:
+    """Запустить замерщик и тред-наблюдатель (вызывается в уже работающем цикле событий)"""
+    global _task, _thread, _beat
+
+    interval = CONFIG['monitor']['lag_interval']
+    threshold = CONFIG['monitor']['stall_threshold']
+    _beat = time.monotonic()
+    _stopped.clear()
+    _task = asyncio.create_task(_sample(interval, threshold))
+    _thread = threading.Thread(target=_watch, args=(threading.get_ident(), interval, threshold),
+                               name='loop-monitor', daemon=True)
+    _thread.start()
+
+
+async def stop() -> None:
+    """Остановить наблюдение"""
+    global _task, _thread
+
+    _stopped.set()
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    if _thread is not None:
+        await asyncio.to_thread(_thread.join)
+        _thread = None
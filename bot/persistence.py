@@ -0,0 +1,144 @@
+"""Хранение состояния диалогов и user_data в SQLite, чтобы перезапуск бота не сбрасывал настройку работ"""
+
+import json
+import asyncio
+import logging
+import sqlite3 as sl
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """Персистентность для ConversationHandler'а и user_data в локальной SQLite
+
+    Телеграм-бот сам передаёт изменения не чаще раза в update_interval секунд; здесь они дополнительно копятся
+    и записываются в БД одной транзакцией на весь проход, а не по одной на пользователя."""
+
+    def __init__(self, path: str, update_interval: float):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False), update_interval=update_interval)
+        self.path = path
+        self._con = sl.connect(path, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        with self._con:
+            self._con.executescript(SCHEMA)
+
+        # ждущие записи изменения: user_id -> json (None - удалить), (name, key) -> состояние (None - удалить)
+        self._users: dict[int, str | None] = {}
+        self._conversations: dict[tuple[str, str], int | None] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._write_lock = asyncio.Lock()
+
+    # --- загрузка при запуске ---
+
+    async def get_user_data(self) -> dict[int, dict]:
+        rows = self._con.execute("SELECT user_id, data FROM user_data").fetchall()
+        users = {user_id: json.loads(data) for user_id, data in rows}
+        for data in users.values():
+            # генерации, шедшие до перезапуска, уже не завершатся - иначе пользователь не сможет создать работу
+            data['is_generating'] = False
+        logger.info(f"Restored data of {len(users)} users from {self.path}")
+        return users
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = self._con.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    # --- изменения (копятся и записываются пачкой) ---
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._users[user_id] = json.dumps(data, ensure_ascii=False)  # сериализуем сразу, объект ещё будет меняться
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        self._conversations[name, json.dumps(key)] = new_state
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # --- запись ---
+
+    def _schedule_flush(self) -> None:
+        """Запланировать запись накопившихся изменений (одну на все вызовы update_* этого прохода)"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self) -> None:
+        await asyncio.sleep(0)  # даём остальным update_* текущего прохода добавить свои изменения
+        self._flush_task = None
+        await self._write()
+
+    async def _write(self) -> None:
+        users, self._users = self._users, {}
+        conversations, self._conversations = self._conversations, {}
+        if not users and not conversations:
+            return
+
+        async with self._write_lock:  # записи идут строго по порядку, чтобы старые данные не затёрли новые
+            await asyncio.to_thread(self._write_sync, users, conversations)
+
+    def _write_sync(self, users: dict, conversations: dict) -> None:
+        with self._con:
+            self._con.executemany("DELETE FROM user_data WHERE user_id = ?",
+                                  [(user_id,) for user_id, data in users.items() if data is None])
+            self._con.executemany("INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                                  [(user_id, data) for user_id, data in users.items() if data is not None])
+            self._con.executemany("DELETE FROM conversations WHERE name = ? AND key = ?",
+                                  [key for key, state in conversations.items() if state is None])
+            self._con.executemany("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                  [(*key, state) for key, state in conversations.items() if state is not None])
+
+    async def flush(self) -> None:
+        """Записать всё оставшееся и закрыть БД (вызывается при выключении бота)"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
+        self._con.close()
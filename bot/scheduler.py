@@ -0,0 +1,155 @@
+"""Планировщик генерации работ: общая очередь с ограничениями и честной (по кругу) очерёдностью пользователей"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Awaitable
+
+from gen import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """В очереди генерации нет мест"""
+
+
+class Job:
+    """Одна работа в очереди планировщика"""
+
+    def __init__(self, user_id: str, func: Callable[..., Awaitable], args: tuple):
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: asyncio.Task | None = None  # появляется, когда работа начинает выполняться
+        self.started_at: float | None = None
+
+    @property
+    def started(self) -> bool:
+        return self.task is not None
+
+    def done(self) -> bool:
+        return self.future.done()
+
+
+class Scheduler:
+    """Очередь работ с ограничением общего числа и числа одновременных работ одного пользователя
+
+    Пользователи обслуживаются по кругу: пока у одного в очереди несколько работ, другие не ждут их все."""
+
+    def __init__(self, max_queued: int, max_running: int, max_per_user: int, default_duration: float):
+        self.max_queued = max_queued
+        self.max_running = max_running
+        self.max_per_user = max_per_user
+
+        self._queues: dict[str, deque[Job]] = {}  # ждущие работы каждого пользователя
+        self._order: deque[str] = deque()  # очередность пользователей, у которых есть ждущие работы
+        self._running: dict[str, set[Job]] = {}
+        self._durations: deque[float] = deque([default_duration], maxlen=20)  # для оценки времени ожидания
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return sum(len(jobs) for jobs in self._running.values())
+
+    def submit(self, user_id: str, func: Callable[..., Awaitable], *args) -> Job:
+        """Поставить в очередь выполнение func(*args) от имени пользователя user_id"""
+
+        if self.queued >= self.max_queued:
+            raise QueueFull
+
+        job = Job(user_id, func, args)
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._order.append(user_id)
+        self._queues[user_id].append(job)
+
+        self._dispatch()
+        return job
+
+    def _can_start(self, user_id: str) -> bool:
+        return len(self._running.get(user_id, ())) < self.max_per_user
+
+    def _dispatch(self) -> None:
+        """Запустить ждущие работы, пока есть свободные места (пользователи перебираются по кругу)"""
+
+        skipped = 0
+        while self._order and self.running < self.max_running and skipped < len(self._order):
+            user_id = self._order.popleft()
+            if not self._can_start(user_id):
+                self._order.append(user_id)
+                skipped += 1
+                continue
+
+            skipped = 0
+            job = self._queues[user_id].popleft()
+            if self._queues[user_id]:
+                self._order.append(user_id)
+            else:
+                del self._queues[user_id]
+            self._start(job)
+
+    def _start(self, job: Job) -> None:
+        job.started_at = time.monotonic()
+        job.task = asyncio.create_task(job.func(*job.args))
+        self._running.setdefault(job.user_id, set()).add(job)
+        job.task.add_done_callback(lambda _: self._finish(job))
+
+    def _finish(self, job: Job) -> None:
+        running = self._running[job.user_id]
+        running.discard(job)
+        if not running:
+            del self._running[job.user_id]
+
+        if job.task.cancelled():
+            job.future.cancel()
+        elif job.task.exception() is not None:
+            job.future.set_exception(job.task.exception())
+        else:
+            self._durations.append(time.monotonic() - job.started_at)
+            job.future.set_result(job.task.result())
+
+        self._dispatch()
+
+    def position(self, job: Job) -> int:
+        """Сколько работ будет запущено раньше данной (0 - работа уже выполняется)"""
+
+        if job.started or job.done():
+            return 0
+
+        # повторяем круговой обход очередей пользователей, как это сделает _dispatch
+        queues = [list(self._queues[user_id]) for user_id in self._order]
+        position = 0
+        for i in range(max(map(len, queues))):
+            for q in queues:
+                if i < len(q):
+                    position += 1
+                    if q[i] is job:
+                        return position
+        return position
+
+    def eta(self, job: Job) -> int:
+        """Примерное время ожидания начала работы в секундах"""
+        average = sum(self._durations) / len(self._durations)
+        return round((self.position(job) + self.max_running - 1) // self.max_running * average)
+
+    def cancel(self, user_id: str) -> None:
+        """Отменить все ждущие и выполняющиеся работы пользователя"""
+
+        for job in self._queues.pop(user_id, ()):
+            job.future.cancel()
+        if user_id in self._order:
+            self._order.remove(user_id)
+
+        for job in list(self._running.get(user_id, ())):
+            job.task.cancel()
+
+        logger.info(f"Generation jobs of user (id = {user_id}) were cancelled")
+
+
+SCHEDULER = Scheduler(**CONFIG['scheduler']['limits'])
@@ -0,0 +1,196 @@
+"""Локальная заглушка Bot API: проверка бота без телеграма и замер задержки ответа на обновления
+
+Запуск: python -m bot.standin data/standin_updates.jsonl [--mode webhook] [--save result.json]
+
+Заглушка отвечает на запросы бота вместо api.telegram.org (в data/config.yaml нужно указать
+telegram.base_url: http://127.0.0.1:8081/bot и telegram.base_file_url: http://127.0.0.1:8081/file/bot) и по очереди
+отдаёт ему записанные обновления (см. telegram.record_updates): в режиме polling - ответом на getUpdates,
+в режиме webhook - POST-запросом на вебхук с секретом из telegram.webhook.secret_token_file. Для каждого обновления
+замеряется время от его отправки до первого ответного запроса бота (sendMessage, answerCallbackQuery и т.п.)."""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+import urllib.parse
+import urllib.request
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from gen import CONFIG
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'EqGen', 'username': 'eqgen_bot'}
+
+
+class StandIn:
+    """Состояние заглушки: обновления для getUpdates и время каждого запроса бота"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: deque[dict] = deque()  # обновления, ещё не отданные через getUpdates
+        self.calls: list[tuple[float, str]] = []  # (время, метод) запросов бота, кроме getUpdates
+        self.ready = False  # бот запущен и готов получать обновления
+        self.message_id = 0
+
+    def call(self, method: str, params: dict):
+        """Ответить на запрос бота к методу method"""
+
+        if method == 'getupdates':
+            with self.cond:
+                self.ready = True
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.pending, timeout=float(params.get('timeout', 0)))
+                updates = list(self.pending)
+                self.pending.clear()
+            return updates
+
+        with self.cond:
+            self.calls.append((time.perf_counter(), method))
+            if method == 'setwebhook':
+                self.ready = True
+            self.cond.notify_all()
+
+        if method == 'getme':
+            return BOT_USER
+        if method == 'getwebhookinfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'sendmediagroup':
+            return [self.message(params) for _ in json.loads(params.get('media', '[]'))]
+        if method.startswith(('send', 'edit', 'copy')):
+            return self.message(params)
+        return True
+
+    def message(self, params: dict) -> dict:
+        with self.cond:
+            self.message_id += 1
+            message_id = self.message_id
+        chat_id = int(params.get('chat_id', 0))
+        return {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER}
+
+
+def make_handler(standin: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            params = {}
+            if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                params = {k: v[0] for k, v in urllib.parse.parse_qs(body.decode('utf-8')).items()}
+            elif self.headers.get('Content-Type', '').startswith('application/json') and body:
+                params = json.loads(body)
+
+            method = self.path.rstrip('/').rsplit('/', 1)[-1].lower()
+            response = json.dumps({'ok': True, 'result': standin.call(method, params)}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        do_GET = do_POST
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def post_update(url: str, secret: str, update: dict) -> None:
+    """Отправить обновление на вебхук, как это делает телеграм"""
+    request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST', headers={
+        'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret})
+    urllib.request.urlopen(request, timeout=10).close()
+
+
+def replay(standin: StandIn, updates: list[dict], mode: str, url: str, secret: str,
+           timeout: float, settle: float) -> list[dict]:
+    """По очереди отправить боту обновления и замерить время до его первого ответного запроса"""
+
+    results = []
+    for update_id, update in enumerate(updates, start=1):
+        update = {**update, 'update_id': update_id}  # записи разных запусков могут повторять айди
+        with standin.cond:
+            mark = len(standin.calls)
+
+        t = time.perf_counter()
+        if mode == 'webhook':
+            post_update(url, secret, update)
+        else:
+            with standin.cond:
+                standin.pending.append(update)
+                standin.cond.notify_all()
+
+        with standin.cond:
+            answered = standin.cond.wait_for(lambda: len(standin.calls) > mark, timeout=timeout)
+            first = standin.calls[mark] if answered else None
+
+        # ждём, пока бот закончит отвечать, чтобы его запросы не приписались следующему обновлению
+        while True:
+            with standin.cond:
+                count = len(standin.calls)
+            time.sleep(settle)
+            with standin.cond:
+                if len(standin.calls) == count:
+                    break
+
+        kind = next((k for k in update if k != 'update_id'), '')
+        text = update.get('message', {}).get('text') or update.get('callback_query', {}).get('data', '')
+        results.append({'update': f"{kind} {text}".strip(), 'first_call': first[1] if first else None,
+                        'seconds': first[0] - t if first else None})
+    return results
+
+
+def summary(results: list[dict]) -> dict:
+    seconds = sorted(r['seconds'] for r in results if r['seconds'] is not None)
+    if not seconds:
+        return {'answered': 0, 'total': len(results)}
+    return {'answered': len(seconds), 'total': len(results), 'mean': statistics.mean(seconds),
+            'p50': seconds[len(seconds) // 2], 'p95': seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))],
+            'max': seconds[-1]}
+
+
+def main() -> int:
+    webhook = CONFIG['telegram']['webhook']
+    parser = argparse.ArgumentParser(prog='python -m bot.standin', description=__doc__.splitlines()[0])
+    parser.add_argument('updates', help='файл с записанными обновлениями (по одному JSON в строке)')
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=CONFIG['telegram']['mode'])
+    parser.add_argument('--port', type=int, default=8081, help='порт заглушки Bot API')
+    parser.add_argument('--webhook-url', default=f"http://127.0.0.1:{webhook['port']}/{webhook['url_path']}")
+    parser.add_argument('--repeat', type=int, default=1, help='сколько раз прогнать все обновления')
+    parser.add_argument('--timeout', type=float, default=10, help='сколько ждать ответа бота на обновление')
+    parser.add_argument('--settle', type=float, default=0.3, help='пауза без запросов, после которой ответ окончен')
+    parser.add_argument('--save', help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    with open(args.updates, encoding='utf-8') as f:
+        updates = [json.loads(line) for line in f if line.strip()] * args.repeat
+
+    standin = StandIn()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(standin))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Bot API stand-in is listening on http://127.0.0.1:{args.port}, waiting for the bot...", file=sys.stderr)
+
+    with standin.cond:
+        standin.cond.wait_for(lambda: standin.ready)
+    secret = ''
+    if args.mode == 'webhook':
+        with open(webhook['secret_token_file'], encoding='utf-8') as f:
+            secret = f.read().strip()
+        time.sleep(1)  # вебхук-сервер бота поднимается сразу после setWebhook
+
+    results = replay(standin, updates, args.mode, args.webhook_url, secret, args.timeout, args.settle)
+    report = {'mode': args.mode, 'summary': summary(results), 'results': results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
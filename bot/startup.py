@@ -0,0 +1,108 @@
+"""Быстрый запуск бота: генерация загружается в фоне, а время запуска под контролем
+
+main.py импортирует этот модуль первым, так что отсчёт времени запуска идёт с самого начала. Модули бота не
+импортируют семпай, нампай и pylatex: бот начинает отвечать в меню сразу, а генерация (и процессы решателя)
+загружаются в фоне уже после запуска.
+
+Запуск: python -m bot.startup [--top 15] - время импорта модулей бота по пакетам (в чистом процессе с
+-X importtime); код 1, если при запуске импортируется что-то из HEAVY."""
+
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import importlib
+import subprocess
+
+STARTED = time.perf_counter()
+
+from gen import CONFIG, metrics, solver  # noqa: E402
+from . import monitor  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+HEAVY = ('sympy', 'numpy', 'pylatex', 'yamale')  # не должны импортироваться до начала работы бота
+
+# модули бота, которые импортирует main.py
+MODULES = ('bot.main_menu', 'bot.examples_menu', 'bot.equations_menu', 'bot.common_handlers', 'bot.util',
+           'bot.persistence', 'bot.monitor')
+
+_warm_up: asyncio.Task | None = None
+
+
+def _load_generation() -> None:
+    """Импортировать модули генерации и поднять процессы решателя (выполняется в отдельном треде)"""
+    try:
+        t = time.perf_counter()
+        for module in ('gen.templates', 'gen.latex', 'gen.artifacts'):
+            importlib.import_module(module)
+        imported = time.perf_counter() - t
+        solver.start()
+        logger.info(f"Generation stack loaded in background: imports {imported:.2f} s, "
+                    f"total {time.perf_counter() - t:.2f} s")
+    except Exception:
+        logger.exception("Failed to load generation stack in background, it will be loaded on first use")
+
+
+async def post_init(application) -> None:
+    """Бот готов принимать обновления: записать время запуска и начать фоновую загрузку генерации"""
+    global _warm_up
+
+    seconds = time.perf_counter() - STARTED
+    metrics.gauge('eqgen_startup_seconds', seconds)
+    heavy = [name for name in HEAVY if name in sys.modules]
+    logger.info(f"Bot is ready to serve in {seconds:.2f} seconds"
+                + (f" (heavy modules imported at startup: {heavy})" if heavy else ""))
+
+    await monitor.start()
+
+    # если работы генерируют внешние воркеры, боту генерация не нужна вовсе
+    if not CONFIG['workers']['queue']:
+        _warm_up = asyncio.create_task(asyncio.to_thread(_load_generation))
+
+
+async def warmed_up() -> None:
+    """Дождаться окончания фоновой загрузки генерации (если она была)"""
+    if _warm_up is not None:
+        await asyncio.shield(_warm_up)
+
+
+def import_times() -> tuple[dict[str, float], float]:
+    """Импортировать модули бота в чистом процессе и сложить собственное время импорта модулей по пакетам
+    верхнего уровня; вернуть его и общее время процесса"""
+
+    t = time.perf_counter()
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {', '.join(MODULES)}"],
+                            capture_output=True, text=True, check=True).stderr
+    total = time.perf_counter() - t
+
+    packages: dict[str, float] = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line.removeprefix('import time:').split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return packages, total
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m bot.startup', description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=15, help='сколько самых долгих пакетов показать')
+    args = parser.parse_args()
+
+    packages, total = import_times()
+    print(f"Startup imports: {sum(packages.values()):.3f} s ({total:.3f} s with interpreter start)")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {package:<24} {seconds:.3f} s")
+
+    heavy = [name for name in HEAVY if name in packages]
+    if heavy:
+        print(f"Heavy modules imported at startup: {', '.join(heavy)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
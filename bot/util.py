@@ -1,6 +1,10 @@
 """Вспомогательные функции и классы для бота"""
 
+import os
+import asyncio
 import string
+import secrets
+import tempfile
 from pathlib import Path
 
 from telegram import Update, InlineKeyboardButton
@@ -9,7 +13,8 @@ from telegram.error import BadRequest
 from telegram.constants import ParseMode
 from typing import Callable
 
-from . import LOCALES
+from gen import solver, pool, metrics, workspace, CONFIG
+from . import LOCALES, monitor, startup
 
 
 class CustomContext(CallbackContext):
@@ -104,12 +109,15 @@ class SavedMessage:
 def answer_query(func: Callable) -> Callable:
     """Декоратор ответа на query-запрос при срабатывании хэндлера"""
 
+    name = monitor.handler_name(func)
+
     async def answered(update: Update, context: CustomContext):
-        query = update.callback_query
-        if query is not None:
-            await query.answer()
+        with monitor.handler_span(name):
+            query = update.callback_query
+            if query is not None:
+                await query.answer()
 
-        return await func(update, context)
+            return await func(update, context)
 
     return answered
 
@@ -118,25 +126,28 @@ def handle_input(success_func: Callable, fail_func: Callable = None, file: bool
     """Декоратор, обрабатывающий пользовательский ввод"""
 
     def ti_decorator(func: Callable) -> Callable:
+        name = monitor.handler_name(func)
+
         async def _wrapper(update: Update, context: CustomContext):
-            # получаем ввод
-            result = await update.message.effective_attachment.get_file() if file else update.message.text
-
-            # удаляем сообщение пользователя, больше оно не нужно
-            await update.message.delete()
-
-            # если обернутая функция вернула True, изменяем/удаляем сообщение бота и выполняем success_func,
-            # иначе выполняем fail_func
-            if await func(update, context, result):
-                msg = context.saved_message('input')
-                if edit_text:
-                    await msg.edit(edit_text)
+            with monitor.handler_span(name):
+                # получаем ввод
+                result = await update.message.effective_attachment.get_file() if file else update.message.text
+
+                # удаляем сообщение пользователя, больше оно не нужно
+                await update.message.delete()
+
+                # если обернутая функция вернула True, изменяем/удаляем сообщение бота и выполняем success_func,
+                # иначе выполняем fail_func
+                if await func(update, context, result):
+                    msg = context.saved_message('input')
+                    if edit_text:
+                        await msg.edit(edit_text)
+                    else:
+                        await msg.delete()
+
+                    return await success_func(update, context)
                 else:
-                    await msg.delete()
-
-                return await success_func(update, context)
-            else:
-                return await fail_func(update, context)
+                    return await fail_func(update, context)
 
         return _wrapper
 
@@ -160,16 +171,67 @@ async def remove_alarm(context: CustomContext) -> None:
     await context.bot.delete_message(chat_id=context.job.data[0], message_id=context.job.data[1])
 
 
-def clear_output(name: str, user_id: str) -> None:
-    """Очистить out/user_id и equations/custom/user_id"""
+async def refill_pools(context: CustomContext) -> None:
+    """Пополнить пулы заранее решённых уравнений в отдельном треде, не блокируя обработку запросов"""
+    await startup.warmed_up()  # решатель поднимается в фоне после запуска бота
+    from gen import templates
+    await asyncio.to_thread(templates.refill_pools)
+
+
+async def write_metrics(context: CustomContext) -> None:
+    """Сохранить текущие метрики генерации в файл для сборщика (textfile-коллектор node_exporter'а)"""
+    await asyncio.to_thread(metrics.write, CONFIG['metrics']['file'])
+
+
+def _append_line(path: str, line: str) -> None:
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+async def record_update(update: Update, context: CustomContext) -> None:
+    """Дописать входящее обновление в файл telegram.record_updates (для воспроизведения заглушкой bot.standin)
+
+    Запись идёт в отдельном треде, чтобы диск не задерживал цикл событий на каждом обновлении."""
+    await asyncio.to_thread(_append_line, CONFIG['telegram']['record_updates'], update.to_json())
+
+
+def webhook_secret(path: str) -> str:
+    """Прочитать секрет вебхука из файла, а если файла нет - создать новый секрет и сохранить его туда
+
+    Секрет пишется во временный файл с правами 0600 (mkstemp), который затем атомарно становится файлом секрета
+    (link не перезаписывает уже существующий): если две копии бота запускаются одновременно, обе получат секрет
+    той, что успела первой, и ни одна не прочитает файл недописанным."""
+    path = Path(path)
+    if not path.exists():
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(secrets.token_urlsafe(32))
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+    return path.read_text(encoding='utf-8').strip()
+
+
+async def stop_generation(application: Application) -> None:
+    """Корректно остановить процессы движка решения уравнений и закрыть БД при выключении бота"""
+    await monitor.stop()
+    await startup.warmed_up()  # иначе фоновый запуск решателя может закончиться уже после его остановки
+    await asyncio.to_thread(solver.shutdown)
+    pool.close()
+
+
+async def collect_garbage(context: CustomContext) -> None:
+    """Убрать брошенные рабочие папки компиляции и пользовательские шаблоны, которые больше не нужны ни одной работе"""
 
-    path = Path(f"out/{user_id}")
-    if path.exists():
-        for x in (path / 'pdf').glob("*.pdf"):
-            Path(x).unlink()
-        (path / 'zip' / f'{name}.zip').unlink(missing_ok=True)
+    referenced = set()
+    for user_id, data in context.application.user_data.items():
+        for eq_id, *_ in data.get('task', {}).get('examples', []):
+            referenced.add((str(user_id), eq_id))
+        if data.get('buffered_file_id'):  # шаблон загружен, но пользователь ещё вводит его название
+            referenced.add((str(user_id), data['buffered_file_id']))
 
-    path2 = Path(f"data/equations/custom/{user_id}")
-    if path2.exists():
-        for x in path2.glob("*.yaml"):
-            Path(x).unlink()
+    await asyncio.to_thread(workspace.collect)
+    await asyncio.to_thread(workspace.collect_custom, referenced)
@@ -0,0 +1,6 @@
+"""Пакет генерации уравнений и сборки проверочных работ"""
+
+import yaml
+
+# общие настройки генерации (пулы уравнений и т.д.)
+CONFIG: dict = yaml.load(open('data/config.yaml', 'r', encoding='utf-8'), yaml.Loader)
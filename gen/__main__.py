@@ -0,0 +1,143 @@
+"""Пакетная генерация работ без телеграма: много работ по манифесту сразу на всех ядрах
+
+Запуск: python -m gen manifest.yaml [--out batch] [--jobs 4] [--save report.json]
+
+Манифест (YAML или JSON) - список работ (или словарь с ключом tasks) в том же виде, что и работа в боте:
+{name, description, variants, examples: [[айди шаблона, количество, фильтры?], ...], seed?}; для пользовательских
+шаблонов можно указать user_id, в папке которого их искать. Ограничений бота на количество вариантов и уравнений
+здесь нет. Каждая работа пишется в свою папку NNNN_название: pdf вариантов, ответы и архив. Папка появляется
+атомарно, только когда работа готова целиком, поэтому после сбоя повторный запуск с тем же манифестом пропускает
+готовые работы и доделывает остальные."""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+
+import yaml
+
+from . import solver, pool, task as task_module
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(path: Path) -> list[dict]:
+    """Прочитать работы из манифеста, дополнив их необязательные поля"""
+
+    text = path.read_text(encoding='utf-8')
+    data = json.loads(text) if path.suffix == '.json' else yaml.safe_load(text)
+    if isinstance(data, dict):
+        data = data['tasks']
+
+    tasks = []
+    for num, spec in enumerate(data, start=1):
+        if not spec.get('examples') or spec.get('variants', 1) < 1:
+            raise ValueError(f"Task #{num} must have examples and at least one variant")
+        tasks.append({'variants': spec.get('variants', 1), 'name': spec.get('name') or f"Работа {num}",
+                      'description': spec.get('description', ''), 'examples': spec['examples'],
+                      'seed': spec.get('seed'), 'user_id': spec.get('user_id')})
+    return tasks
+
+
+def task_dirname(num: int, task: dict) -> str:
+    """Имя папки работы: номер в манифесте (по нему работа узнаётся при повторном запуске) и название"""
+    name = re.sub(r'\s+', ' ', re.sub(r'[^\w\- ]', ' ', task['name'])).strip()[:50]
+    return f"{num:04d}_{name}" if name else f"{num:04d}"
+
+
+async def run_task(num: int, task: dict, out: Path) -> dict:
+    """Сгенерировать работу и атомарно записать её папку; вернуть статистику по ней"""
+
+    final = out / task_dirname(num, task)
+    partial = out / f".{final.name}.partial"
+    shutil.rmtree(partial, ignore_errors=True)  # остатки прерванного прошлого запуска
+
+    t = time.perf_counter()
+    result = await task_module.generate(task, task['user_id'] or 'batch')
+
+    def write() -> None:
+        partial.mkdir(parents=True)
+        for filename, data in result.files.items():
+            (partial / filename).write_bytes(data)
+        (partial / f"{final.name}.zip").write_bytes(result.archive)
+        os.rename(partial, final)
+
+    await asyncio.to_thread(write)
+    return {'pdfs': len(result.files), 'equations': task['variants'] * sum(ex[1] for ex in task['examples']),
+            'seconds': time.perf_counter() - t, 'repeated': sorted(result.repeated)}
+
+
+async def run_batch(tasks: list[dict], out: Path, jobs: int) -> dict:
+    """Сгенерировать все ещё не готовые работы, выполняя не больше jobs одновременно"""
+
+    out.mkdir(parents=True, exist_ok=True)
+    slots = asyncio.Semaphore(jobs)
+    report = {'done': 0, 'skipped': 0, 'failed': [], 'pdfs': 0, 'equations': 0}
+
+    async def run(num: int, task: dict) -> None:
+        if (out / task_dirname(num, task)).exists():
+            report['skipped'] += 1
+            return
+        async with slots:
+            try:
+                stats = await run_task(num, task, out)
+            except Exception as e:
+                logger.info(f"Task #{num} failed", exc_info=True)
+                report['failed'].append({'task': num, 'name': task['name'], 'error': repr(e)})
+                print(f"[{num}/{len(tasks)}] FAILED {task['name']}: {e!r}", file=sys.stderr)
+                return
+        report['done'] += 1
+        report['pdfs'] += stats['pdfs']
+        report['equations'] += stats['equations']
+        print(f"[{num}/{len(tasks)}] {task['name']}: {stats['pdfs']} pdf in {stats['seconds']:.1f} s"
+              + (f", repeated {stats['repeated']}" if stats['repeated'] else ''), file=sys.stderr)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(run(num, task) for num, task in enumerate(tasks, start=1)))
+    seconds = time.perf_counter() - t
+
+    report['seconds'] = seconds
+    report['tasks_per_minute'] = report['done'] / seconds * 60
+    report['pdfs_per_second'] = report['pdfs'] / seconds
+    report['equations_per_second'] = report['equations'] / seconds
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m gen', description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', type=Path, help='YAML или JSON со списком работ')
+    parser.add_argument('--out', type=Path, default=Path('batch'), help='куда складывать готовые работы')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='сколько работ генерировать одновременно')
+    parser.add_argument('--save', type=Path, help='сохранить отчёт в файл')
+    parser.add_argument('--verbose', action='store_true', help='подробный лог генерации')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+
+    tasks = load_manifest(args.manifest)
+
+    # из кэша берутся только работы с сидом (см. gen.task), одинаковые работы без сида всегда генерируются заново
+    solver.start()
+    try:
+        report = asyncio.run(run_batch(tasks, args.out, args.jobs))
+    finally:
+        solver.shutdown()
+        pool.close()
+
+    report['total'] = len(tasks)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.save:
+        args.save.write_text(text, encoding='utf-8')
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
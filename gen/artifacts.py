@@ -0,0 +1,95 @@
+"""Кэш готовых работ: повторный запрос той же работы (с тем же сидом или work_id) отдаётся с диска без семпая
+и pdflatex'а"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+
+from . import CONFIG
+from .templates import template_path, basic_template_ids
+
+logger = logging.getLogger(__name__)
+
+
+def task_key(task: dict, user_id: str) -> str:
+    """Получить ключ кэша для работы: хэш канонической записи её параметров, сида, work_id и содержимого шаблонов"""
+
+    template_ids = basic_template_ids()
+    templates = {}
+    for eq_id, *_ in task['examples']:
+        path = template_path(eq_id, None if eq_id in template_ids else user_id)
+        templates[eq_id] = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+    spec = {'variants': task['variants'], 'name': task['name'], 'description': task['description'],
+            'examples': [list(example) for example in task['examples']], 'seed': task.get('seed'),
+            'work_id': task.get('work_id'), 'templates': templates}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def lookup(key: str) -> tuple[dict[str, bytes], bytes, set[str]] | None:
+    """Найти работу в кэше, вернуть её pdf-файлы (имя -> содержимое), архив и шаблоны с повторами
+
+    Если работы в кэше нет, возвращает None."""
+
+    entry = Path(CONFIG['artifacts']['dir']) / key
+    try:
+        meta = json.loads((entry / 'meta.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    if not (entry / 'pdf').is_dir():  # запись из старой версии кэша, где хранился только архив
+        return None
+
+    try:
+        files = {pdf.name: pdf.read_bytes() for pdf in (entry / 'pdf').glob('*.pdf')}
+        archive = (entry / 'archive.zip').read_bytes()
+    except OSError:  # запись вытеснили, пока мы её читали
+        return None
+
+    os.utime(entry)  # время изменения папки служит отметкой последнего использования для вытеснения
+    return files, archive, set(meta['repeated'])
+
+
+def store(key: str, files: dict[str, bytes], archive: bytes, repeated: set[str]) -> None:
+    """Сохранить готовые pdf и архив работы в кэш и вытеснить самые давние записи, если кэш превысил лимит"""
+
+    cache_dir = Path(CONFIG['artifacts']['dir'])
+    entry = cache_dir / key
+    tmp = cache_dir / f'.{key}.tmp'
+
+    # собираем запись во временной папке и переименовываем целиком, чтобы никто не увидел её наполовину
+    tmp.mkdir(parents=True, exist_ok=True)
+    (tmp / 'pdf').mkdir(exist_ok=True)
+    for filename, data in files.items():
+        (tmp / 'pdf' / filename).write_bytes(data)
+    (tmp / 'archive.zip').write_bytes(archive)
+    (tmp / 'meta.json').write_text(json.dumps({'repeated': sorted(repeated)}), encoding='utf-8')
+    try:
+        os.rename(tmp, entry)
+    except OSError:  # ту же работу уже успели сохранить параллельно
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    evict()
+
+
+def evict() -> None:
+    """Удалять самые давно использованные записи, пока кэш больше max_bytes"""
+
+    cache_dir = Path(CONFIG['artifacts']['dir'])
+    entries = []
+    total = 0
+    for entry in cache_dir.iterdir():
+        if entry.name.startswith('.'):
+            continue
+        size = sum(f.stat().st_size for f in entry.rglob('*') if f.is_file())
+        entries.append((entry.stat().st_mtime, size, entry))
+        total += size
+
+    for _, size, entry in sorted(entries):
+        if total <= CONFIG['artifacts']['max_bytes']:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        logger.info(f"Evicted cached task {entry.name}")
@@ -0,0 +1,171 @@
+"""Бенчмарки генерации: уравнения по каждому шаблону, сборка и компиляция документов, работа целиком
+
+Запуск: python -m gen.bench [--quick] [--save result.json] [--baseline baseline.json]
+
+Результаты выводятся в JSON; при указании --baseline замеры сравниваются с ним, и если какой-то этап
+стал медленнее больше чем на --tolerance (и при этом больше чем на --min-delta секунд), команда завершается
+с кодом 1."""
+
+import sys
+import json
+import time
+import random
+import statistics
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+
+from . import CONFIG, solver, pool
+from .templates import basic_template_ids, make_equations, refill_pool, clear_rendered
+from .latex import generate_question_doc, generate_answer_doc, compile_pdf
+from . import task as task_module
+
+
+def measure(func, *args, repeat: int = 1, setup=None) -> float:
+    """Медиана repeat замеров времени выполнения func(*args) в секундах (setup() вызывается перед каждым замером)"""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t)
+    return statistics.median(times)
+
+
+def bench_templates(results: dict, amount: int, warm_size: int, workdir: Path, repeat: int) -> None:
+    """make_equations по каждому базовому шаблону: на пустом пуле и на заполненном"""
+
+    pool.open_db(str(workdir / 'pregen.db'))
+
+    for eq_id in basic_template_ids():
+        def cold() -> None:
+            # дорешанные уравнения попадают в пул, поэтому перед каждым замером он очищается, а одинаковый сид
+            # даёт каждому замеру (и каждому запуску бенчмарка) одни и те же аргументы
+            pool.delete(eq_id)
+            clear_rendered()
+            random.seed(0)
+
+        seconds = measure(make_equations, eq_id, amount, repeat=repeat, setup=cold)
+        results[f'make_equations.cold.{eq_id}'] = {'seconds': seconds, 'per_second': amount / seconds}
+
+    # заполняем временный пул до warm_size уравнений на шаблон, как это делает фоновое пополнение
+    low_water, CONFIG['pool']['low_water'] = CONFIG['pool']['low_water'], warm_size
+    try:
+        for eq_id in basic_template_ids():
+            while refill_pool(eq_id):
+                pass
+    finally:
+        CONFIG['pool']['low_water'] = low_water
+
+    for eq_id in basic_template_ids():
+        seconds = measure(make_equations, eq_id, amount, repeat=5)
+        results[f'make_equations.warm.{eq_id}'] = {'seconds': seconds, 'per_second': amount / seconds}
+
+
+def sample_variants(variants: int, tasks: int, amount: int) -> list[tuple]:
+    """Варианты с уравнениями из (уже заполненного) пула для замеров сборки документов"""
+    eq_ids = list(basic_template_ids())[:tasks]
+    return [(num, [make_equations(eq_id, amount) for eq_id in eq_ids]) for num in range(1, variants + 1)]
+
+
+def bench_latex(results: dict) -> None:
+    """Сборка документов pylatex'ом и компиляция pdflatex'ом"""
+
+    variants = sample_variants(5, 3, 10)
+
+    results['latex.question_doc'] = {'seconds': measure(
+        lambda: generate_question_doc(1, 'Бенчмарк', 'Описание', variants[0][1]).dumps(), repeat=5)}
+    results['latex.answer_doc'] = {'seconds': measure(lambda: generate_answer_doc(variants).dumps(), repeat=5)}
+
+    if shutil.which('pdflatex') is None:
+        results['latex.compile'] = None  # pdflatex не установлен, замерять нечего
+        return
+
+    doc = generate_question_doc(1, 'Бенчмарк', 'Описание', variants[0][1])
+    results['latex.compile'] = {'seconds': measure(
+        lambda: asyncio.run(compile_pdf(doc)), repeat=3)}
+
+
+def bench_generate(results: dict, matrix: list[tuple], repeat: int) -> None:
+    """Генерация работы целиком для сетки (варианты, задания, уравнения в задании)"""
+
+    if shutil.which('pdflatex') is None:
+        return
+
+    enabled, CONFIG['artifacts']['enabled'] = CONFIG['artifacts']['enabled'], False  # кэш работ тут ни к чему
+    try:
+        for variants, tasks, amount in matrix:
+            spec = {'variants': variants, 'name': 'bench', 'description': '',
+                    'examples': [(eq_id, amount) for eq_id in list(basic_template_ids())[:tasks]]}
+            seconds = measure(lambda: asyncio.run(task_module.generate(spec, 'bench')), repeat=repeat)
+            results[f'generate.{variants}x{tasks}x{amount}'] = {'seconds': seconds}
+    finally:
+        CONFIG['artifacts']['enabled'] = enabled
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """Найти этапы, ставшие медленнее базовых замеров больше чем на tolerance и больше чем на min_delta секунд
+    (замедления быстрых этапов на доли миллисекунды - это шум, а не регрессия)"""
+    regressions = []
+    for name, base in baseline['results'].items():
+        current = results.get(name)
+        if (base and current and current['seconds'] > base['seconds'] * (1 + tolerance)
+                and current['seconds'] - base['seconds'] > min_delta):
+            regressions.append(f"{name}: {base['seconds']:.4f}s -> {current['seconds']:.4f}s")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m gen.bench', description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='уменьшенная сетка замеров')
+    parser.add_argument('--amount', type=int, default=10, help='уравнений на замер make_equations')
+    parser.add_argument('--warm-size', type=int, default=100, help='размер пула шаблона для "тёплых" замеров')
+    parser.add_argument('--save', type=Path, help='сохранить результаты в файл')
+    parser.add_argument('--baseline', type=Path, help='сравнить с ранее сохранёнными результатами')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое замедление (0.2 = 20%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help='замедление меньше этого (в секундах) регрессией не считается')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='сколько раз повторять замеры "на холодную" и генерацию целиком (берётся медиана)')
+    args = parser.parse_args()
+
+    if args.quick:
+        matrix = [(1, 1, 5), (2, 2, 5)]
+    else:
+        matrix = [(v, t, a) for v in (1, 5, 10) for t in (1, 3) for a in (5, 20)]
+
+    random.seed(0)
+    results: dict = {}
+    solver.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='eqgen_bench_') as tmp:
+            bench_templates(results, args.amount, args.warm_size, Path(tmp), args.repeat)
+            bench_latex(results)
+            bench_generate(results, matrix, args.repeat)
+            pool.close()
+    finally:
+        solver.shutdown()
+
+    report = {'meta': {'python': platform.python_version(), 'machine': platform.machine(),
+                       'solver': CONFIG['solver'], 'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+              'results': results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.save:
+        args.save.write_text(text, encoding='utf-8')
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(encoding='utf-8')), args.tolerance,
+                              args.min_delta)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Готовые формулы ответов для базовых шаблонов, чтобы не решать каждое уравнение семпаем
+
+Решатель объявляется в шаблоне ключом solver и получает значения аргументов, а возвращает множество решений
+в том же виде, в каком его вернули бы solveset/nonlinsolve (либо None, если случай вырожденный и его
+лучше отдать семпаю)."""
+
+import sympy as sp
+from typing import Callable
+
+
+def linear(args: dict) -> sp.Set:
+    """a*x + b = 0"""
+    return sp.FiniteSet(sp.Rational(-args['b'], args['a']))
+
+
+def factored_quadratic(args: dict) -> sp.Set:
+    """(g*h)*x^2 + (g*m + h*n)*x + m*n = 0, то есть (g*x + n)(h*x + m) = 0"""
+    return sp.FiniteSet(sp.Rational(-args['n'], args['g']), sp.Rational(-args['m'], args['h']))
+
+
+def cube(args: dict) -> sp.Set:
+    """x^3 = a^3 (над комплексными числами, как и у solveset)"""
+    a = sp.Integer(args['a'])
+    return sp.FiniteSet(a, a * (-sp.Rational(1, 2) - sp.sqrt(3) * sp.I / 2),
+                        a * (-sp.Rational(1, 2) + sp.sqrt(3) * sp.I / 2))
+
+
+def exponential(args: dict) -> sp.Set:
+    """c^a = c^x (c > 1, поэтому единственный действительный корень - a)"""
+    return sp.FiniteSet(sp.Integer(args['a']))
+
+
+def cramer(args: dict) -> sp.Set | None:
+    """Система a*x + b*y = c, d*x + e*y = f по формулам Крамера"""
+    a, b, c, d, e, f = (args[k] for k in 'abcdef')
+    det = a * e - b * d
+    if det == 0:
+        return None  # решений нет либо бесконечно много - пусть разбирается семпай
+    return sp.FiniteSet((sp.Rational(c * e - b * f, det), sp.Rational(a * f - c * d, det)))
+
+
+SOLVERS: dict[str, Callable[[dict], sp.Set | None]] = {
+    'linear': linear,
+    'factored_quadratic': factored_quadratic,
+    'cube': cube,
+    'exponential': exponential,
+    'cramer': cramer,
+}
@@ -0,0 +1,220 @@
+"""Очередь работ в SQLite между ботом и внешними воркерами генерации (python -m gen.worker)
+
+Бот ставит работу в очередь и забирает из БД готовые pdf по мере того, как воркер их публикует; воркер берёт
+работы из очереди, генерирует их через gen.task и следит, не отменили ли их."""
+
+import os
+import json
+import time
+import socket
+import threading
+import asyncio
+import logging
+import sqlite3 as sl
+from typing import AsyncIterator
+from contextlib import contextmanager, aclosing
+
+from . import CONFIG
+from .sampling import PoolExhausted
+from .task import Result
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed, cancelled
+    worker TEXT,
+    heartbeat REAL,
+    repeated TEXT,
+    archive BLOB,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_job ON files (job_id, id);
+"""
+
+
+class JobCancelled(Exception):
+    """Работу отменили, пока воркер её генерировал"""
+
+
+_con: sl.Connection | None = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def _db() -> sl.Connection:
+    """Подключение к БД очереди на время блока with (одно на процесс, запросы к нему идут по очереди)"""
+    global _con
+    with _lock:
+        if _con is None:
+            _con = sl.connect(CONFIG['workers']['db'], timeout=30, check_same_thread=False, isolation_level=None)
+            _con.execute("PRAGMA journal_mode=WAL")
+            _con.execute("PRAGMA synchronous=NORMAL")
+            _con.executescript(SCHEMA)
+        yield _con
+
+
+# --- сторона бота ---
+
+def submit(user_id: str, task: dict) -> int:
+    """Поставить работу в очередь и вернуть её айди"""
+    with _db() as con:
+        return con.execute("INSERT INTO jobs (user_id, task) VALUES (?, ?)",
+                           (user_id, json.dumps(task, ensure_ascii=False))).lastrowid
+
+
+def poll(job_id: int, after: int) -> tuple[str, list[tuple], dict | None]:
+    """Получить статус работы, опубликованные после файла с айди after файлы и строку работы (для готовой)"""
+    with _db() as con:
+        status = con.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        files = con.execute("SELECT id, filename, data FROM files WHERE job_id = ? AND id > ? ORDER BY id",
+                            (job_id, after)).fetchall()
+        row = None
+        if status in ('done', 'failed'):
+            repeated, archive, error = con.execute("SELECT repeated, archive, error FROM jobs WHERE id = ?",
+                                                   (job_id,)).fetchone()
+            row = {'repeated': json.loads(repeated or '[]'), 'archive': archive,
+                   'error': json.loads(error or 'null')}
+    return status, files, row
+
+
+def forget(job_id: int, cancel: bool) -> None:
+    """Удалить работу и её файлы (если работа ещё идёт - сначала отметить её отменённой для воркера)"""
+    with _db() as con:
+        if cancel:
+            con.execute("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status IN ('queued', 'running')",
+                        (job_id,))
+        else:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("DELETE FROM files WHERE job_id = ?", (job_id,))
+            con.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            con.execute("COMMIT")
+
+
+def _raise_error(error: dict) -> None:
+    if error['type'] == 'pool_exhausted':
+        raise PoolExhausted(error['eq_id'], error['available'], error['required'])
+    raise RuntimeError(f"Generation worker failed: {error['message']}")
+
+
+async def stream(task: dict, user_id: str, result: Result) -> AsyncIterator[tuple[str, bytes]]:
+    """То же, что gen.task.stream, но работу генерирует внешний воркер"""
+
+    job_id = await asyncio.to_thread(submit, user_id, task)
+    finished = False
+    last = 0
+    try:
+        while True:
+            status, files, row = await asyncio.to_thread(poll, job_id, last)
+            for last, filename, data in files:
+                result.files[filename] = data
+                yield filename, data
+
+            if status == 'done':
+                result.repeated = set(row['repeated'])
+                result.archive = row['archive']
+                finished = True
+                return
+            if status == 'failed':
+                finished = True
+                _raise_error(row['error'])
+            if status == 'cancelled':  # отменили не мы (например, воркер отдал работу), больше ждать нечего
+                finished = True
+                raise RuntimeError(f"Job {job_id} was cancelled")
+
+            await asyncio.sleep(CONFIG['workers']['poll_interval'])
+    finally:
+        # отменённую ботом работу помечаем для воркера, он её остановит и удалит; завершённую удаляем сами
+        await asyncio.to_thread(forget, job_id, not finished)
+
+
+async def generate(task: dict, user_id: str) -> Result:
+    """То же, что gen.task.generate, но работу генерирует внешний воркер"""
+    result = Result()
+    async with aclosing(stream(task, user_id, result)) as pdfs:
+        async for _ in pdfs:
+            pass
+    return result
+
+
+# --- сторона воркера ---
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker: str) -> tuple[int, str, dict] | None:
+    """Взять первую работу из очереди (атомарно, даже если воркеров несколько)"""
+    with _db() as con:
+        row = con.execute("""
+            UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?
+            WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1) AND status = 'queued'
+            RETURNING id, user_id, task""", (worker, time.time())).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2])
+
+
+def heartbeat(job_id: int) -> None:
+    """Отметить, что воркер ещё работает над работой; если её отменили - сообщить об этом исключением"""
+    with _db() as con:
+        if not con.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'",
+                           (time.time(), job_id)).rowcount:
+            raise JobCancelled
+
+
+def publish(job_id: int, filename: str, data: bytes) -> None:
+    """Опубликовать готовый pdf работы"""
+    with _db() as con:
+        con.execute("INSERT INTO files (job_id, filename, data) VALUES (?, ?, ?)", (job_id, filename, data))
+
+
+def finish(job_id: int, result: Result) -> None:
+    """Отметить работу выполненной и сохранить её архив"""
+    with _db() as con:
+        con.execute("UPDATE jobs SET status = 'done', repeated = ?, archive = ? WHERE id = ? AND status = 'running'",
+                    (json.dumps(sorted(result.repeated)), result.archive, job_id))
+
+
+def fail(job_id: int, error: Exception) -> None:
+    """Отметить работу проваленной (ошибка дойдёт до бота)"""
+    if isinstance(error, PoolExhausted):
+        info = {'type': 'pool_exhausted', 'eq_id': error.eq_id, 'available': error.available,
+                'required': error.required}
+    else:
+        info = {'type': 'error', 'message': repr(error)}
+    with _db() as con:
+        con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ? AND status = 'running'",
+                    (json.dumps(info), job_id))
+
+
+def cleanup() -> None:
+    """Убрать отменённые работы и вернуть в очередь брошенные (воркер упал, не опубликовав ни одного файла)
+
+    Брошенные работы, часть файлов которых уже ушла пользователю, проваливаются: без сида новая генерация
+    дала бы другие варианты, не совпадающие с уже отправленными."""
+
+    stale = time.time() - CONFIG['workers']['lease']
+    with _db() as con:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("DELETE FROM files WHERE job_id IN (SELECT id FROM jobs WHERE status = 'cancelled')")
+        con.execute("DELETE FROM jobs WHERE status = 'cancelled'")
+        requeued = con.execute("""
+            UPDATE jobs SET status = 'queued', worker = NULL
+            WHERE status = 'running' AND heartbeat < ? AND id NOT IN (SELECT job_id FROM files)""",
+                               (stale,)).rowcount
+        failed = con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE status = 'running' AND heartbeat < ?",
+                             (json.dumps({'type': 'error', 'message': 'worker lost'}), stale)).rowcount
+        con.execute("COMMIT")
+    if requeued or failed:
+        logger.warning(f"Requeued {requeued} and failed {failed} jobs abandoned by workers")
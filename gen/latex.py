@@ -1,8 +1,33 @@
-"""Работа с лэйтеком, создание документов"""
+"""Работа с лэйтеком, создание и компиляция документов"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import weakref
+import subprocess
+from pathlib import Path
+from typing import AsyncIterator
 
 from pylatex import Command, Center, Section, Enumerate, NoEscape, Subsection, Document, FlushRight, LargeText, \
     FlushLeft
 
+from . import CONFIG, metrics, workspace
+
+logger = logging.getLogger(__name__)
+
+# ограничение одновременно запущенных pdflatex'ов и блокировки сборки форматов преамбулы (чтобы одновременно
+# пришедшие документы не собирали один формат дважды); они привязаны к циклу событий, поэтому у каждого цикла
+# (бот, бенчмарки, отдельные запуски) свои
+_loop_primitives: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _primitives() -> tuple[asyncio.Semaphore, dict[str, asyncio.Lock]]:
+    loop = asyncio.get_running_loop()
+    if loop not in _loop_primitives:
+        _loop_primitives[loop] = (asyncio.Semaphore(CONFIG['latex']['concurrency'] or os.cpu_count()), {})
+    return _loop_primitives[loop]
+
 
 def generate_default_doc() -> Document:
     """Создать основу для будущего документа"""
@@ -65,3 +90,95 @@ def generate_answer_doc(variants: list) -> Document:
                     if cols > 1:
                         doc.append(Command("end", "multicols"))
     return doc
+
+
+async def _run_pdflatex(*args: str, cwd: str, env: dict = None) -> None:
+    """Запустить pdflatex с аргументами args в папке cwd"""
+    process = await asyncio.create_subprocess_exec(
+        'pdflatex', '--interaction=nonstopmode', *args,
+        cwd=cwd, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    try:
+        output, _ = await process.communicate()
+    except asyncio.CancelledError:  # генерацию отменили - не оставляем pdflatex работать впустую
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, 'pdflatex', output)
+
+
+async def preamble_format(preamble: str) -> str | None:
+    """Получить имя .fmt-файла с заранее загруженной преамбулой (собрать его, если такой преамбулы ещё не было)
+
+    Имя файла зависит от хэша преамбулы, так что формат пересобирается только при её изменении.
+    Если собрать формат не удалось, возвращается None и документ компилируется обычным способом."""
+
+    name = 'eqgen_' + hashlib.sha1(preamble.encode('utf-8')).hexdigest()[:16]
+    fmt_dir = Path(CONFIG['latex']['format_dir'])
+
+    async with _primitives()[1].setdefault(name, asyncio.Lock()):
+        if (fmt_dir / f'{name}.fmt').exists():
+            return name
+
+        fmt_dir.mkdir(parents=True, exist_ok=True)
+        with workspace.workspace() as tmp:
+            (tmp / f'{name}.tex').write_text(preamble, encoding='utf-8')
+            try:
+                # "&pdflatex" - взять за основу обычный формат pdflatex'а, \dump - сохранить состояние после преамбулы
+                await _run_pdflatex('-ini', f'-jobname={name}', '&pdflatex', f'{name}.tex\\dump', cwd=tmp)
+            except (subprocess.CalledProcessError, OSError):
+                logger.exception("Failed to build precompiled preamble format, falling back to plain pdflatex")
+                return None
+            os.replace(tmp / f'{name}.fmt', fmt_dir / f'{name}.fmt')  # атомарно, на случай параллельных сборок
+
+        logger.info(f"Built precompiled preamble format {name}")
+        return name
+
+
+async def compile_pdf(doc: Document) -> bytes:
+    """Скомпилировать документ, не блокируя цикл событий, и вернуть содержимое pdf"""
+
+    source = doc.dumps()
+    args, env = [], None
+
+    if CONFIG['latex']['precompiled_preamble']:
+        # преамбула (всё до \begin{document}) у всех документов одна и та же, поэтому она берётся из готового
+        # формата, а компилируется только тело документа
+        split = source.index(r'\begin{document}')
+        fmt = await preamble_format(source[:split])
+        if fmt:
+            source = source[split:]
+            args = [f'-fmt={fmt}']
+            env = {**os.environ, 'TEXFORMATS': f"{Path(CONFIG['latex']['format_dir']).resolve()}:"}
+
+    async with _primitives()[0]:
+        # у каждого документа своя рабочая папка, чтобы вспомогательные файлы (.aux, .log) не пересекались
+        # (папку можно держать на tmpfs - тогда промежуточные файлы вообще не доходят до диска)
+        with workspace.workspace() as tmp:
+            (tmp / 'doc.tex').write_text(source, encoding='utf-8')
+            with metrics.span('pdflatex'):
+                await _run_pdflatex(*args, 'doc.tex', cwd=tmp, env=env)
+            return (tmp / 'doc.pdf').read_bytes()
+
+
+async def _compile_named(doc: Document, filename: str) -> tuple[str, bytes]:
+    return filename, await compile_pdf(doc)
+
+
+async def compile_pdfs(docs: list[tuple[Document, str]]) -> dict[str, bytes]:
+    """Скомпилировать параллельно несколько документов, заданных парами (документ, имя pdf-файла)"""
+    return dict(await asyncio.gather(*(_compile_named(doc, filename) for doc, filename in docs)))
+
+
+async def compile_pdfs_as_completed(docs: list[tuple[Document, str]]) -> AsyncIterator[tuple[str, bytes]]:
+    """Скомпилировать параллельно несколько документов, отдавая пары (имя файла, pdf) в порядке готовности"""
+
+    tasks = [asyncio.ensure_future(_compile_named(doc, filename)) for doc, filename in docs]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # обход прервали (отмена генерации или ошибка) - незачем докомпилировать остальные документы
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,137 @@
+"""Замеры этапов генерации: именованные отрезки времени (spans), счётчики и гистограммы в формате Prometheus"""
+
+import time
+import logging
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_gauges: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}  # ключ -> [счётчики по корзинам..., сумма, количество]
+
+# разбивка времени текущей работы по этапам (копируется в треды asyncio.to_thread и задачи asyncio вместе с контекстом)
+_job: contextvars.ContextVar[dict | None] = contextvars.ContextVar('job', default=None)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Увеличить счётчик"""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name: str, value: float, **labels) -> None:
+    """Установить текущее значение показателя"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Добавить значение в гистограмму"""
+    with _lock:
+        hist = _histograms.setdefault(_key(name, labels), [0] * len(BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Замерить время блока with как этап stage (например, span('solve', template='linear_100'))"""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t
+        observe('eqgen_stage_seconds', seconds, stage=stage, **labels)
+        job = _job.get()
+        if job is not None:
+            with _lock:
+                job[stage] = job.get(stage, 0) + seconds
+
+
+@contextmanager
+def job(description: str):
+    """Собрать разбивку времени работы по этапам и записать её в лог по окончании"""
+    breakdown = {}
+    token = _job.set(breakdown)
+    t = time.perf_counter()
+    try:
+        yield breakdown
+    finally:
+        try:
+            _job.reset(token)
+        except ValueError:  # незакрытый асинхронный генератор с job внутри финализируется уже в другом контексте
+            pass
+        seconds = time.perf_counter() - t
+        inc('eqgen_jobs_total')
+        observe('eqgen_job_seconds', seconds)
+        stages = ', '.join(f"{stage} = {s:.3f}s" for stage, s in sorted(breakdown.items(), key=lambda x: -x[1]))
+        logger.info(f"{description} took {seconds:.3f}s: {stages}")
+
+
+def _labels(labels: tuple, extra: str = '') -> str:
+    items = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def render() -> str:
+    """Все показатели в текстовом формате Prometheus"""
+
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), hist in sorted(_histograms.items()):
+            for bound, n in zip(BUCKETS, hist):
+                le = _labels(labels, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{le} {n}")
+            le = _labels(labels, 'le="+Inf"')
+            lines.append(f"{name}_bucket{le} {hist[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {hist[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def write(path: str) -> None:
+    """Записать показатели в файл (для textfile-коллектора node_exporter'а), атомарно через переименование"""
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text(render(), encoding='utf-8')
+    tmp.replace(path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int) -> ThreadingHTTPServer:
+    """Запустить в отдельном треде HTTP-сервер, отдающий показатели по любому пути (например, /metrics)"""
+    server = ThreadingHTTPServer(('', port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
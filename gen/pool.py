@@ -0,0 +1,217 @@
+"""Работа с БД заранее решённых уравнений (pregen.db)"""
+
+import queue
+import hashlib
+import logging
+import threading
+import sqlite3 as sl
+from typing import NamedTuple
+from contextlib import contextmanager
+
+from . import CONFIG, metrics, sampling
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "data/equations/pregen.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS equations (
+    id INTEGER PRIMARY KEY,
+    template TEXT NOT NULL,
+    form_hash TEXT NOT NULL,
+    form TEXT NOT NULL,
+    solution TEXT NOT NULL,
+    form_len INTEGER,
+    solution_len INTEGER,
+    root_count INTEGER,
+    root_type TEXT,
+    difficulty REAL,
+    UNIQUE (template, form_hash)
+);
+"""
+
+# метаданные уравнений (добавлены позже самой таблицы, в старых БД их нет)
+META_COLUMNS = {'form_len': 'INTEGER', 'solution_len': 'INTEGER', 'root_count': 'INTEGER', 'root_type': 'TEXT',
+                'difficulty': 'REAL'}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS equations_filter ON equations (template, root_type, difficulty);
+CREATE INDEX IF NOT EXISTS equations_form_len ON equations (template, form_len);
+"""
+
+COLUMNS = "form, solution, form_len, solution_len, root_count, root_type, difficulty"
+
+
+class Equation(NamedTuple):
+    """Решённое уравнение: форма и решение в лэйтеке и метаданные для отбора и разметки"""
+    form: str
+    solution: str
+    form_len: int  # длина формы (у систем - самого длинного уравнения)
+    solution_len: int
+    root_count: int | None  # None - корней бесконечно много или их не удалось посчитать
+    root_type: str | None  # integer, rational, irrational, complex, empty, other (None - неизвестно)
+    difficulty: float | None  # примерная сложность, см. gen.templates.estimate_difficulty
+
+
+class ConnectionPool:
+    """Пул переиспользуемых подключений к SQLite (общий для всех тредов процесса)"""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sl.Connection:
+        con = sl.connect(self.path, timeout=30, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")  # читатели не блокируют писателя (фоновое пополнение пулов)
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _acquire(self) -> sl.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                con = self._connect()
+                if not self._initialized:
+                    _init_db(con)
+                    self._initialized = True
+                return con
+
+        return self._idle.get()  # все подключения заняты, ждём освободившееся
+
+    @contextmanager
+    def connection(self) -> sl.Connection:
+        """Взять подключение из пула на время блока with"""
+        con = self._acquire()
+        try:
+            yield con
+        finally:
+            self._idle.put(con)
+
+    def close(self) -> None:
+        """Закрыть все свободные подключения"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+
+def _init_db(con: sl.Connection) -> None:
+    """Создать таблицу уравнений и перенести в неё старые таблицы вида {eq_id} (form, solution)"""
+
+    with con:
+        con.executescript(SCHEMA)
+
+        columns = {row[1] for row in con.execute("PRAGMA table_info(equations)")}
+        for column, column_type in META_COLUMNS.items():
+            if column not in columns:
+                con.execute(f"ALTER TABLE equations ADD COLUMN {column} {column_type}")
+        con.executescript(INDEXES)
+
+        old_tables = [row[0] for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name != 'equations'")]
+        for table in old_tables:
+            rows = [(table, form_hash(form), form, solution)
+                    for form, solution in con.execute(f'SELECT form, solution FROM "{table}"')]
+            con.executemany("INSERT OR IGNORE INTO equations (template, form_hash, form, solution) VALUES (?, ?, ?, ?)",
+                            rows)
+            con.execute(f'DROP TABLE "{table}"')
+            logger.info(f"Migrated {len(rows)} equations of template '{table}' into the shared table")
+
+        # у старых уравнений восстанавливаем хотя бы длины, тип корней и сложность остаются неизвестными
+        con.execute("UPDATE equations SET form_len = length(form), solution_len = length(solution) "
+                    "WHERE form_len IS NULL")
+
+
+_pool = ConnectionPool(DB_PATH, CONFIG['pool']['connections'])
+
+
+def form_hash(form: str) -> str:
+    """Хэш формы уравнения, по которому отсеиваются повторы"""
+    return hashlib.sha1(form.encode('utf-8')).hexdigest()
+
+
+def count(eq_id: str) -> int:
+    """Количество уравнений в пуле шаблона eq_id"""
+    with metrics.span('pool_read', template=eq_id), _pool.connection() as con:
+        return con.execute("SELECT count(*) FROM equations WHERE template = ?", (eq_id,)).fetchone()[0]
+
+
+def add(eq_id: str, equations: list[Equation]) -> int:
+    """Добавить уравнения в пул шаблона eq_id, пропуская повторы; вернуть кол-во новых"""
+    with metrics.span('pool_write', template=eq_id), _pool.connection() as con:
+        before = con.total_changes
+        with con:
+            con.executemany(f"INSERT OR IGNORE INTO equations (template, form_hash, {COLUMNS}) "
+                            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(eq_id, form_hash(eq.form), *eq) for eq in equations])
+        return con.total_changes - before
+
+
+def delete(eq_id: str) -> int:
+    """Удалить весь пул шаблона eq_id; вернуть кол-во удалённых уравнений"""
+    with metrics.span('pool_write', template=eq_id), _pool.connection() as con:
+        with con:
+            return con.execute("DELETE FROM equations WHERE template = ?", (eq_id,)).rowcount
+
+
+def _where(filters: dict | None) -> tuple[str, list]:
+    """Условия SQL для отбора уравнений (см. gen.sampling.matches)"""
+
+    conditions, params = [], []
+    if not filters:
+        return '', params
+    if filters.get('root_types'):
+        conditions.append(f"root_type IN ({', '.join('?' * len(filters['root_types']))})")
+        params += filters['root_types']
+    if filters.get('difficulty'):
+        conditions.append("difficulty BETWEEN ? AND ?")
+        params += filters['difficulty']
+    if filters.get('max_form_len'):
+        conditions.append("form_len <= ?")
+        params.append(filters['max_form_len'])
+    return ''.join(f" AND {condition}" for condition in conditions), params
+
+
+# при выборке с весами уравнения выбираются из стольких (на одно нужное) случайных кандидатов из пула
+WEIGHTED_CANDIDATES = 20
+
+
+def sample(eq_id: str, amount: int, filters: dict = None) -> list[Equation]:
+    """Случайно выбрать без повторов до amount уравнений из пула шаблона eq_id, подходящих под filters
+
+    Без весов выборка делается прямо в БД. С весами (см. gen.sampling.weights) из БД берутся случайные
+    кандидаты с запасом, а из них уже с весами выбираются amount."""
+
+    where, params = _where(filters)
+    limit = amount * WEIGHTED_CANDIDATES if sampling.weighted(filters) else amount
+    with metrics.span('pool_read', template=eq_id), _pool.connection() as con:
+        rows = con.execute(f"SELECT {COLUMNS} FROM equations WHERE template = ?{where} ORDER BY random() LIMIT ?",
+                           (eq_id, *params, limit)).fetchall()
+    equations = [Equation(*row) for row in rows]
+    if sampling.weighted(filters):
+        equations = sampling.draw(equations, amount, sampling.weights(equations, filters))
+    return equations
+
+
+def close() -> None:
+    """Закрыть подключения к БД"""
+    _pool.close()
+
+
+def open_db(path: str) -> None:
+    """Переключиться на другой файл БД (например, на временный пул для бенчмарков)"""
+    global _pool
+    _pool.close()
+    _pool = ConnectionPool(path, CONFIG['pool']['connections'])
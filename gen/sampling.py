@@ -0,0 +1,120 @@
+"""Выборка уравнений без повторов и политики на случай, когда различных уравнений не хватает"""
+
+import math
+import heapq
+import random
+
+# что делать, если различных уравнений меньше, чем требуется:
+TOP_UP = 'top_up'  # дорешать недостающие (если и это не помогло - действовать как RELAX)
+RELAX = 'relax'  # разрешить повторы уравнений в задании
+FAIL = 'fail'  # сразу прервать генерацию с ошибкой PoolExhausted
+
+POLICIES = (TOP_UP, RELAX, FAIL)
+
+
+# отбор уравнений задания (третий элемент задания в task['examples'], все ключи необязательны; задаются в манифесте
+# пакетной генерации python -m gen, в боте их пока не задать, но задания с ними он сохраняет как есть):
+# root_types - допустимые типы корней (integer, rational, irrational, complex, empty, other),
+# difficulty - [от, до] по оценке сложности, max_form_len - максимальная длина формы,
+# sort: difficulty - расположить уравнения задания от простых к сложным,
+# target_difficulty - не отсекать, а предпочитать уравнения со сложностью ближе к этой (выборка с весами, см. weights)
+FILTER_KEYS = ('root_types', 'difficulty', 'max_form_len', 'sort', 'target_difficulty')
+
+# во сколько раз больше подходящих уравнений набирать (решать), чтобы выбрать из них задание с весами
+WEIGHTED_OVERSAMPLE = 4
+
+# при выборке по target_difficulty вес уравнения вдвое меньше на каждые DIFFICULTY_HALVING отклонения сложности
+# (сложность уравнений одного шаблона обычно различается лишь на десятые); у уравнений с неизвестной сложностью
+# (из старых версий пула) - вес UNKNOWN_DIFFICULTY_WEIGHT
+DIFFICULTY_HALVING = 0.1
+UNKNOWN_DIFFICULTY_WEIGHT = 0.01
+
+
+def matches(eq, filters: dict | None) -> bool:
+    """Подходит ли уравнение (gen.pool.Equation) под фильтры задания"""
+
+    if not filters:
+        return True
+    if filters.get('root_types') and eq.root_type not in filters['root_types']:
+        return False
+    if filters.get('difficulty'):
+        low, high = filters['difficulty']
+        if eq.difficulty is None or not low <= eq.difficulty <= high:
+            return False
+    if filters.get('max_form_len') and eq.form_len > filters['max_form_len']:
+        return False
+    return True
+
+
+def weighted(filters: dict | None) -> bool:
+    """Выбираются ли уравнения с весами (см. weights)"""
+    return bool(filters) and filters.get('target_difficulty') is not None
+
+
+def weights(equations: list, filters: dict | None) -> list[float] | None:
+    """Веса уравнений для выборки: чем ближе сложность к target_difficulty, тем вероятнее уравнение попадёт
+    в задание (None - без весов, все равновероятны)"""
+
+    if not weighted(filters):
+        return None
+    target = filters['target_difficulty']
+    return [UNKNOWN_DIFFICULTY_WEIGHT if eq.difficulty is None
+            else 2 ** (-abs(eq.difficulty - target) / DIFFICULTY_HALVING) for eq in equations]
+
+
+class PoolExhausted(Exception):
+    """Шаблону не хватило различных уравнений для задания"""
+
+    def __init__(self, eq_id: str, available: int, required: int):
+        super().__init__(f"Template '{eq_id}' has only {available} distinct equations, {required} required")
+        self.eq_id = eq_id
+        self.available = available
+        self.required = required
+
+
+def distinct(equations: list) -> list:
+    """Убрать из списка уравнений повторяющиеся формы, сохранив порядок"""
+    seen = set()
+    result = []
+    for eq in equations:
+        if eq[0] not in seen:
+            seen.add(eq[0])
+            result.append(eq)
+    return result
+
+
+def candidates_needed(missing: int, tried: int, accepted: int) -> int:
+    """Сколько кандидатов взять, чтобы с запасом набрать ещё missing подходящих, если из tried кандидатов подошли
+    accepted (доля оценивается со сглаживанием, так что и без единого подошедшего размер пачки конечен)"""
+    rate = (accepted + 1) / (tried + 2)
+    return math.ceil(1.5 * missing / rate)
+
+
+def draw_indices(n: int, k: int, seen: set[int], rng: random.Random = random) -> list[int]:
+    """Выбрать до k ещё не выбранных (не из seen) чисел от 0 до n - 1, добавив их в seen"""
+
+    if len(seen) + 2 * k < n // 2:  # свободных номеров много - просто угадываем, повторы редки
+        result = []
+        while len(result) < k:
+            i = rng.randrange(n)
+            if i not in seen:
+                seen.add(i)
+                result.append(i)
+        return result
+
+    rest = [i for i in range(n) if i not in seen]
+    result = rng.sample(rest, min(k, len(rest)))
+    seen.update(result)
+    return result
+
+
+def draw(items: list, k: int, weights: list[float] = None, rng: random.Random = random) -> list:
+    """Выбрать без повторов min(k, len(items)) элементов, при наличии весов - с вероятностью, пропорциональной весу"""
+
+    k = min(k, len(items))
+    if weights is None:
+        return rng.sample(items, k)
+
+    # алгоритм Эфраимидиса-Спиракиса: у каждого элемента ключ u^(1/w), берём k наибольших
+    keyed = ((rng.random() ** (1 / w), i) for i, w in enumerate(weights) if w > 0)
+    return [items[i] for _, i in heapq.nlargest(k, keyed)]
@@ -0,0 +1,112 @@
+"""Движок решения уравнений в отдельных процессах, чтобы семпай не боролся за GIL с ботом"""
+
+import os
+import signal
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from . import CONFIG, metrics
+
+logger = logging.getLogger(__name__)
+
+_executor: ProcessPoolExecutor | None = None
+_workers = 0
+_lock = threading.Lock()
+
+
+def _warm_up() -> None:
+    """Инициализация рабочего процесса: семпай импортируется один раз, а не при первом решаемом уравнении"""
+    import sympy  # noqa: F401
+
+    # Ctrl+C приходит всей группе процессов; останавливать пул должен бот (shutdown), а не сами процессы
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _ping(_) -> int:
+    return os.getpid()
+
+
+def _create(workers: int) -> ProcessPoolExecutor:
+    # процессы запускаются не форком бота (у него к этому моменту уже работают другие треды, и форк мог бы
+    # унаследовать чужие захваченные блокировки), а из отдельного чистого процесса (см. solver.start_method)
+    context = multiprocessing.get_context(CONFIG['solver']['start_method'])
+    return ProcessPoolExecutor(max_workers=workers, initializer=_warm_up, mp_context=context)
+
+
+def start() -> None:
+    """Запустить пул процессов (если он включён в настройках)"""
+    global _executor, _workers
+
+    if _executor is not None or not CONFIG['solver']['enabled']:
+        return
+
+    _workers = CONFIG['solver']['workers'] or os.cpu_count()
+    _executor = _create(_workers)
+
+    # сразу поднимаем все процессы, чтобы первая же работа не ждала их запуска и импорта семпая
+    pids = set(_executor.map(_ping, range(_workers)))
+    logger.info(f"Solver engine started with {_workers} workers (pids = {sorted(pids)})")
+
+
+def shutdown() -> None:
+    """Остановить пул процессов, отменив ещё не начатые задачи"""
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+        logger.info("Solver engine has been shut down")
+
+
+def _restart(broken: ProcessPoolExecutor) -> ProcessPoolExecutor | None:
+    """Заменить сломанный пул новым (если его ещё не заменил другой тред); вернуть текущий пул"""
+    global _executor
+
+    with _lock:
+        if _executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = _create(_workers)
+            metrics.inc('eqgen_solver_restarts_total')
+            logger.warning("Solver engine has been restarted after a worker process died")
+        return _executor
+
+
+def _map(executor: ProcessPoolExecutor, func: Callable, batches: list, args: tuple) -> list:
+    results = []
+    for batch_result in executor.map(func, *[[arg] * len(batches) for arg in args], batches):
+        results.extend(batch_result)
+    return results
+
+
+def run_batches(func: Callable, items: list, *args) -> list:
+    """Обработать items пачками через func(*args, batch) в пуле процессов, сохранив порядок результатов
+
+    Если пул не запущен, всё считается в текущем процессе. Если процесс пула умер (например, его убило ядро
+    из-за нехватки памяти), пул перезапускается и пачки отправляются ещё раз; умер и при повторе - пул снова
+    перезапускается для следующих работ, а ошибка BrokenProcessPool передаётся дальше. func должна быть
+    функцией уровня модуля, а её аргументы и результаты - сериализуемыми через pickle."""
+
+    executor = _executor
+    if executor is None:
+        return func(*args, items)
+
+    size = CONFIG['solver']['batch_size']
+    batches = [items[i: i + size] for i in range(0, len(items), size)]
+
+    try:
+        return _map(executor, func, batches, args)
+    except BrokenProcessPool:
+        logger.warning(f"Solver worker died while running {func.__name__}, retrying", exc_info=True)
+        executor = _restart(executor)
+    if executor is None:  # пул остановили, пока мы ждали
+        return func(*args, items)
+
+    try:
+        return _map(executor, func, batches, args)
+    except BrokenProcessPool:
+        _restart(executor)
+        raise
@@ -1,57 +1,158 @@
 """Модуль, отвечающий за сборку новой работы и чистку лишних файлов после неё"""
 
+import io
 import time
-import shutil
-import yaml
+import random
+import asyncio
 import logging
-from pathlib import Path
+import zipfile
+from contextlib import aclosing
+from typing import AsyncIterator
 
-from .templates import make_equations
-from .latex import generate_answer_doc, generate_question_doc
+from . import CONFIG, metrics
 
 logger = logging.getLogger(__name__)
 
+# модули самой генерации (семпай, нампай, pylatex) импортируются при первой работе, а не при импорте этого модуля,
+# чтобы бот запускался сразу (см. bot.startup)
 
-def generate(task: dict, user_id: str) -> None:
-    """Создать работу по заданным параметрам и сохранить результат в папке out"""
 
-    t = time.time()  # для учёта затраченного времени на генерацию (дико долго xD)
+def make_documents(task: dict, user_id: str) -> tuple[list[tuple], set[str]]:
+    """Сгенерировать уравнения для всех вариантов и собрать документы
+
+    Возвращает пары (документ, имя pdf-файла) и айди шаблонов, в заданиях которых пришлось повторить уравнения."""
 
-    template_ids = list(yaml.load(open("data/equations/basic_templates.yaml", "r", encoding='utf-8'), yaml.Loader).keys())
+    from .templates import make_equations, basic_template_ids
+    from .latex import generate_answer_doc, generate_question_doc
+
+    template_ids = basic_template_ids()
 
     total_variants = task['variants']
     task_display_name = task['name']
     task_description = task['description']
     examples_conf: list[tuple] = task['examples']
 
-    # Если пользователь впервые создаёт работу, создать необходимые папки для pdf- и zip-файлов
-
-    path = Path(f"out/{user_id}")
-    path.mkdir(exist_ok=True)
-    (path / 'pdf').mkdir(exist_ok=True)
-    (path / 'zip').mkdir(exist_ok=True)
-
-    logger.info(f"User (id = {user_id}) has begun generating new task.\ntask = {task}")
+    # с заданным сидом все уравнения генерируются заново одним генератором, и работа полностью воспроизводима
+    rng = random.Random(task['seed']) if task.get('seed') is not None else None
 
     variants: list[tuple] = []
+    docs: list[tuple] = []
+    repeated: set[str] = set()
 
     for num in range(1, total_variants + 1):
         examples: list[dict] = []
-        for eq_id, amount in examples_conf:
+        for eq_id, amount, *rest in examples_conf:
+            filters = rest[0] if rest else None  # необязательные фильтры по метаданным (см. gen.sampling)
             # если айди нет в списке базовых шаблонов, сообщаем функции искать шаблон в 'custom/user_id'
             if eq_id in template_ids:
-                example = make_equations(eq_id, amount)
+                example = make_equations(eq_id, amount, rng=rng, filters=filters)
             else:
-                example = make_equations(eq_id, amount, user_id=user_id)
+                example = make_equations(eq_id, amount, user_id=user_id, rng=rng, filters=filters)
             examples.append(example)
+            if example['repeated']:
+                repeated.add(eq_id)
         variants.append((num, examples))
 
-        doc = generate_question_doc(num, task_display_name, task_description, examples)
-        doc.generate_pdf(filepath=f"out/{user_id}/pdf/Вариант {num}", compiler="pdflatex")
+        with metrics.span('documents'):
+            doc = generate_question_doc(num, task_display_name, task_description, examples)
+        docs.append((doc, f"Вариант {num}.pdf"))
+
+    with metrics.span('documents'):
+        docs.append((generate_answer_doc(variants), "Ответы.pdf"))
+
+    return docs, repeated
+
+
+class Result:
+    """Готовая работа: pdf-файлы вариантов и ответов, архив с ними и шаблоны с повторами"""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}  # имя файла -> содержимое pdf
+        self.archive: bytes | None = None  # zip со всеми файлами, появляется после последнего pdf
+        self.repeated: set[str] = set()  # айди шаблонов, которым не хватило различных уравнений
+
+
+def make_archive(files: dict[str, bytes]) -> bytes:
+    """Упаковать файлы в zip-архив в памяти"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, data in sorted(files.items()):
+            archive.writestr(filename, data)
+    return buffer.getvalue()
+
 
-    answers = generate_answer_doc(variants)
-    answers.generate_pdf(filepath=f"out/{user_id}/pdf/Ответы", compiler="pdflatex")
+async def generate(task: dict, user_id: str) -> Result:
+    """Создать работу по заданным параметрам целиком (см. политики повторов в gen.sampling)"""
+
+    result = Result()
+    async with aclosing(stream(task, user_id, result)) as pdfs:
+        async for _ in pdfs:
+            pass
+    return result
+
+
+async def stream(task: dict, user_id: str, result: Result) -> AsyncIterator[tuple[str, bytes]]:
+    """Создать работу, отдавая пары (имя файла, pdf) вариантов и ответов по мере их компиляции
+
+    Всё собирается в памяти и складывается в result: повторы - как только сгенерированы уравнения,
+    архив - после последнего pdf."""
+
+    from .templates import template_cache_info
+
+    # время каждого этапа (шаблоны, решение, пул, pdflatex, архив) попадёт в метрики и в лог одной строкой
+    with metrics.job(f"Generation for user (id = {user_id})"):
+        async for pdf in _stream(task, user_id, result):
+            yield pdf
+
+    hits, misses = template_cache_info()[:2]
+    metrics.gauge('eqgen_template_cache_hits', hits)
+    metrics.gauge('eqgen_template_cache_misses', misses)
+
+
+async def _stream(task: dict, user_id: str, result: Result) -> AsyncIterator[tuple[str, bytes]]:
+    """Сама генерация работы (см. stream)"""
+
+    from . import artifacts
+    from .templates import template_cache_info
+    from .latex import compile_pdfs_as_completed
+
+    t = time.time()  # для учёта затраченного времени на генерацию (дико долго xD)
+
+    logger.info(f"User (id = {user_id}) has begun generating new task.\ntask = {task}")
 
-    shutil.make_archive(f"out/{user_id}/zip/{task_display_name}", 'zip', str(path / 'pdf'))  # архивируем готовые пдфки
+    # такую же работу уже создавали - просто берём готовые pdf и архив из кэша. Кэшируются работы с сидом (их
+    # результат определяется ключом) и работы с work_id: бот даёт его каждой новой работе, так что повторная
+    # генерация той же работы (например, после сбоя отправки) отдаёт то же самое, а новая работа с теми же
+    # параметрами (например, для параллельного класса) - новые варианты
+    cacheable = CONFIG['artifacts']['enabled'] and (task.get('seed') is not None or task.get('work_id') is not None)
+    if cacheable:
+        with metrics.span('artifact_cache'):
+            key = await asyncio.to_thread(artifacts.task_key, task, user_id)
+            cached = await asyncio.to_thread(artifacts.lookup, key)
+        metrics.inc('eqgen_artifact_cache_total', result='hit' if cached else 'miss')
+        if cached:
+            result.files, result.archive, result.repeated = cached
+            for pdf in sorted(result.files.items()):
+                yield pdf
+            logger.info(f"User (id = {user_id}) got cached task {key} in {time.time() - t} seconds")
+            return
+
+    # уравнения и документы собираем в отдельном треде, а все варианты и ответы компилируем одновременно,
+    # отдавая каждый pdf сразу по готовности
+    docs, repeated = await asyncio.to_thread(make_documents, task, user_id)
+    result.repeated.update(repeated)
+    async for filename, data in compile_pdfs_as_completed(docs):
+        result.files[filename] = data
+        yield filename, data
+
+    # архивируем готовые пдфки
+    with metrics.span('archive'):
+        result.archive = await asyncio.to_thread(make_archive, result.files)
+
+    if cacheable:
+        await asyncio.to_thread(artifacts.store, key, result.files, result.archive, result.repeated)
 
     logger.info(f"Used (id = {user_id}) successfully finished generation in {time.time() - t} seconds")
+    logger.info(f"Template cache statistics: {template_cache_info()}")
+    if result.repeated:
+        logger.warning(f"User (id = {user_id}) got repeated equations in templates {sorted(result.repeated)}")
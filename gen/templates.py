@@ -1,108 +1,458 @@
 """Модуль низкоуровневой генерации уравнений, включая работу с БД и sympy"""
 
+import os
+import math
+import numpy as np
 import sympy as sp
 import yaml
 import random
-import sqlite3 as sl
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
+from . import CONFIG, solver, pool, sampling, closed_form, metrics
 
-def make_equations(eq_id: str, amount: int, user_id: str = None) -> dict:
-    """Создать уравнения в количестве amount по заданному в eq_id шаблону"""
+logger = logging.getLogger(__name__)
 
+
+def parse_condition(text: str) -> sp.Basic:
+    """Разобрать условие на аргументы шаблона ("a*e - b*d != 0", "b**2 - 4*a*c >= 0")
+
+    != и == семпай превращает не в отношения, а сразу в True/False (сравнивая выражения), поэтому их
+    разбираем сами."""
+    for operator, relation in (('!=', sp.Ne), ('==', sp.Eq)):
+        if operator in text:
+            lhs, rhs = text.split(operator)
+            return relation(sp.sympify(lhs), sp.sympify(rhs))
+    return sp.sympify(text)
+
+
+class CompiledTemplate:
+    """Шаблон уравнения, заранее разобранный и подготовленный для семпая"""
+
+    def __init__(self, conf: dict, path: str, mtime: int):
+        self.conf = conf
+        self.path = path
+        self.mtime = mtime
+        self.description: str = conf['description']
+
+        # превращаем строчки с формой уравнения (или системы ур-ий) в удобоваримый семпаем формат
+        self.forms = []
+        for f in conf['form']:
+            x = f.split("=")
+            self.forms.append(sp.Eq(sp.sympify(x[0]), sp.sympify(x[1]), evaluate=False))
+
+        # создаём словарь с доступными значениями аргументов (range + include - exclude)
+        self.ranges: dict[str, list] = {}
+        for arg_name, arg in conf['arguments'].items():
+            exclude = set(arg['exclude'])
+            self.ranges[arg_name] = [i for i in list(range(*arg['range'])) + arg['include'] if i not in exclude]
+
+        self.roots = sp.symbols(" ".join(conf['roots']))  # помечаем, какие из неизвестных - корни
+
+        # условия на аргументы, при которых уравнение не вырождено (например, определитель системы не равен нулю);
+        # они проверяются нампаем сразу для целых пачек кандидатов, и до семпая доходят только подходящие
+        symbols = sp.symbols(list(self.ranges))
+        self.predicates = [sp.lambdify(symbols, parse_condition(p), 'numpy') for p in conf.get('valid', [])]
+
+        # готовая формула ответа (см. closed_form); у пользовательских шаблонов её не берём, ведь никто не
+        # проверял, что объявленный решатель действительно подходит к их форме
+        self.solver = None
+        if self.is_basic:
+            self.solver = closed_form.SOLVERS.get(conf.get('solver'))
+
+    @property
+    def is_basic(self) -> bool:
+        return self.path.startswith("data/equations/basic/")
+
+    @property
+    def label(self) -> str:
+        """Название шаблона для метрик (все пользовательские шаблоны считаются вместе)"""
+        return os.path.splitext(os.path.basename(self.path))[0] if self.is_basic else 'custom'
+
+    @property
+    def space_size(self) -> int:
+        """Количество всех возможных комбинаций аргументов"""
+        return math.prod(len(values) for values in self.ranges.values())
+
+    @property
+    def is_compact(self) -> bool:
+        """Пул хранится не в БД, а выбирается по номерам комбинаций аргументов (см. sample_compact): комбинаций
+        мало, а ответ считается по готовой формуле, так что решать выбранные уравнения на ходу дёшево"""
+        return self.solver is not None and self.space_size <= CONFIG['pool']['compact_max_space']
+
+    def draw_arguments(self, rng: random.Random = random) -> dict:
+        """Подобрать рандомные значения аргументов"""
+        return {arg: rng.choice(self.ranges[arg]) for arg in self.ranges}
+
+    def valid_mask(self, columns: dict[str, np.ndarray]) -> np.ndarray:
+        """Какие из кандидатов (значения аргументов по столбцам) удовлетворяют условиям valid шаблона"""
+        mask = np.ones(len(next(iter(columns.values()))), dtype=bool)
+        for predicate in self.predicates:
+            with np.errstate(all='ignore'):  # деление на ноль в условии даёт nan/inf, а не ошибку
+                mask &= np.broadcast_to(predicate(*columns.values()), mask.shape)
+        return mask
+
+    def draw_valid_arguments(self, amount: int, rng: random.Random = random) -> list[dict]:
+        """Подобрать до amount комбинаций аргументов, удовлетворяющих условиям valid (кандидаты отбираются пачками)"""
+
+        if not self.predicates:
+            return [self.draw_arguments(rng) for _ in range(amount)]
+
+        arguments = []
+        for _ in range(VALID_ROUNDS):
+            size = max(2 * (amount - len(arguments)), VALID_BATCH)
+            columns = {arg: np.array(rng.choices(values, k=size)) for arg, values in self.ranges.items()}
+            accepted = np.flatnonzero(self.valid_mask(columns))
+            metrics.inc('eqgen_rejected_arguments_total', size - len(accepted), template=self.label)
+            for i in accepted[:amount - len(arguments)]:
+                arguments.append({arg: column[i].item() for arg, column in columns.items()})
+            if len(arguments) >= amount:
+                break
+        return arguments
+
+    def valid_indices(self, indices: list[int]) -> list[int]:
+        """Оставить номера комбинаций аргументов (см. arguments_at), удовлетворяющих условиям valid"""
+
+        if not self.predicates or not indices:
+            return indices
+        rest, columns = np.array(indices), {}
+        for arg, values in self.ranges.items():
+            rest, i = np.divmod(rest, len(values))
+            columns[arg] = np.array(values)[i]
+        accepted = np.flatnonzero(self.valid_mask(columns))
+        metrics.inc('eqgen_rejected_arguments_total', len(indices) - len(accepted), template=self.label)
+        return [indices[i] for i in accepted]
+
+    def arguments_at(self, index: int) -> dict:
+        """Комбинация аргументов под номером index (0 <= index < space_size), номер - число в смешанной системе
+        счисления, где каждый разряд - индекс значения своего аргумента"""
+        arguments = {}
+        for arg, values in self.ranges.items():
+            index, i = divmod(index, len(values))
+            arguments[arg] = values[i]
+        return arguments
+
+
+# сколько пачек кандидатов проверять, прежде чем сдаться (тогда уравнений будет меньше, см. top_up), и их размер
+VALID_ROUNDS = 10
+VALID_BATCH = 256
+
+
+@lru_cache(maxsize=CONFIG['templates']['cache_size'])
+def compile_template(path: str, mtime: int) -> CompiledTemplate:
+    """Прочитать и разобрать шаблон по пути path (mtime - часть ключа кэша, чтобы изменённый файл перечитывался)"""
+    with metrics.span('template_compile'):
+        return CompiledTemplate(yaml.load(open(path, "r", encoding='utf-8'), yaml.Loader), path, mtime)
+
+
+def template_path(eq_id: str, user_id: str = None) -> str:
+    """Получить путь к шаблону eq_id (базовому либо кастомному шаблону пользователя user_id)"""
     if not user_id:  # ищем шаблон в зависимости от того, кастомный он или нет
-        conf = yaml.load(open(f"data/equations/basic/{eq_id}.yaml", "r", encoding='utf-8'), yaml.Loader)
-    else:
-        conf = yaml.load(open(f"data/equations/custom/{user_id}/{eq_id}.yaml", "r", encoding='utf-8'), yaml.Loader)
-
-    # превращаем строчки с формой уравнения (или системы ур-ий) в удобоваримый семпаем формат
-    forms = []
-    for f in conf['form']:
-        x = f.split("=")
-        forms.append(sp.Eq(sp.sympify(x[0]), sp.sympify(x[1]), evaluate=False))
-
-    # создаём словарь с доступными значениями аргументов (range + include - exclude)
-    ranges = {}
-    for arg_name, arg in conf['arguments'].items():
-        ranges[arg_name] = list(range(*arg['range'])) + arg['include']
-        for i in arg['exclude']:
-            ranges[arg_name].remove(i)
-
-    roots = sp.symbols(" ".join(conf['roots']))  # помечаем, какие из неизвестных - корни
-
-    con = sl.connect("data/equations/pregen.db")
-
-    if not user_id:
-        # создаём таблицу для шаблона в базе данных, если таковой нет, и получаем из неё все уравнения (если есть)
-        with con:
-            check = con.execute(f"SELECT count(*) from sqlite_master where type='table' and name='{eq_id}'")
-            if not list(check)[0][0]:
-                con.execute(f"CREATE TABLE {eq_id} (form TEXT, solution TEXT);")
-            equations_in_db = list(con.execute(f"select * from {eq_id}"))
-
-        n = len(equations_in_db)
-
-        # итоговое количество уравнений должно быть в минимум 10 раз больше требуемого кол-ва
-        # поэтому по-настоящему мы генерируем только либо недостающие до "превосходства",
-        # либо просто небольшое количество
-
-        db_supremacy = 10 * amount
-        if n < db_supremacy:
-            eq_to_gen = db_supremacy - n
-        else:
-            eq_to_gen = 50
+        return f"data/equations/basic/{eq_id}.yaml"
+    return f"data/equations/custom/{user_id}/{eq_id}.yaml"
+
+
+def load_template(eq_id: str, user_id: str = None) -> CompiledTemplate:
+    """Загрузить шаблон eq_id из кэша (или разобрать его, если в кэше его нет либо файл изменился)"""
+    path = template_path(eq_id, user_id)
+    return compile_template(path, os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _load_template_ids(path: str, mtime: int) -> dict:
+    return yaml.load(open(path, "r", encoding='utf-8'), yaml.Loader)
+
+
+def basic_template_ids() -> dict:
+    """Получить словарь айди - название базовых шаблонов из basic_templates.yaml (с кэшированием)"""
+    path = "data/equations/basic_templates.yaml"
+    return _load_template_ids(path, os.stat(path).st_mtime_ns)
+
+
+def template_cache_info():
+    """Статистика кэша шаблонов (hits, misses, maxsize, currsize)"""
+    return compile_template.cache_info()
+
+
+def solve_with_sympy(template: CompiledTemplate, eqs: list) -> sp.Set:
+    """Решить уравнение (или систему) в общем случае"""
+    if len(eqs) == 1:
+        return sp.solveset(eqs[0], template.roots)
+    return sp.nonlinsolve(eqs, template.roots)
+
+
+def cross_check(template: CompiledTemplate, eqs: list, arguments: dict, solution: sp.Set) -> sp.Set:
+    """Сверить ответ готовой формулы с семпаем, при расхождении вернуть ответ семпая"""
+
+    reference = solve_with_sympy(template, eqs)
+    if isinstance(reference, sp.ConditionSet):  # семпай сам не смог решить, сверять не с чем
+        return solution
+    if reference != solution:
+        logger.error(f"Closed-form solver of '{template.path}' gave {solution} instead of {reference} "
+                     f"for arguments {arguments}")
+        return reference
+    return solution
+
+
+def form_width(eq_text: str) -> int:
+    """Ширина формы уравнения: у систем её определяет самое длинное из уравнений, а не вся запись со скобками"""
+    texts = eq_text.removeprefix(r"\begin{cases}").removesuffix(r"\end{cases}").split(r"\\")
+    return max(map(len, texts))
+
+
+def describe_solution(solution: sp.Set) -> tuple[int | None, str]:
+    """Количество и тип корней: integer, rational, irrational, complex, empty или other (бесконечные множества,
+    нерешённые уравнения); у систем считаются решения-наборы, а тип определяется по всем их компонентам"""
+
+    if solution == sp.S.EmptySet:
+        return 0, 'empty'
+    if not isinstance(solution, sp.FiniteSet):
+        return None, 'other'
+
+    values = [value for root in solution for value in (root if isinstance(root, sp.Tuple) else (root,))]
+    if all(value.is_integer for value in values):
+        return len(solution), 'integer'
+    if all(value.is_rational for value in values):
+        return len(solution), 'rational'
+    if all(value.is_real for value in values):
+        return len(solution), 'irrational'
+    if any(value.is_real is False for value in values):
+        return len(solution), 'complex'
+    return len(solution), 'other'
+
+
+# насколько тип корней усложняет уравнение
+ROOT_TYPE_WEIGHTS = {'integer': 0, 'empty': 1, 'rational': 1, 'irrational': 2, 'complex': 3, 'other': 3}
+
+
+def estimate_difficulty(form_len: int, root_count: int | None, root_type: str) -> float:
+    """Грубая оценка сложности уравнения: чем длиннее запись, больше корней и "хуже" их тип, тем сложнее"""
+    return round(1 + form_len / 20 + ROOT_TYPE_WEIGHTS[root_type] + max((root_count or 1) - 1, 0) / 2, 1)
+
+
+def make_equation(template: CompiledTemplate, arguments: dict) -> pool.Equation:
+    """Подставить аргументы в шаблон, решить уравнение и вернуть его форму и решение в лэйтеке с метаданными"""
+
+    # подставляем аргументы в ур-е (или систему) и превращаем форму в лэйтек-формат; подстановка идёт
+    # в каждую из частей отдельно, иначе семпай заново пытается вычислить само равенство (а это очень долго)
+    items = arguments.items()
+    eqs = [sp.Eq(f.lhs.subs(items, simultaneous=True), f.rhs.subs(items, simultaneous=True), evaluate=False)
+           for f in template.forms]
+    if len(eqs) == 1:
+        eq_text = sp.latex(eqs[0])
     else:
-        eq_to_gen = amount  # если шаблон кастомный, генерируем ровно столько, сколько требуется
-
-    generated_equations = []
-    # для последующего расчёта кол-ва столбцов в задании (красивая разметка всё такое...)
-    max_solution_length = 0
-    max_form_length = 0
-
-    for _ in range(eq_to_gen):
-        arguments = {arg: random.choice(ranges[arg]) for arg in ranges}.items()  # подбираем рандомные значения арг-ов
-        if len(forms) == 1:
-            # подставляем аргументы в ур-е, решаем его, превращаем форму и ответ в лэйтек-формат
-            final_eq = forms[0].subs(arguments, simultaneous=True)
-            eq_text = sp.latex(final_eq)
-            if len(eq_text) > max_form_length:
-                max_form_length = len(eq_text)
-            solution = sp.latex(sp.solveset(final_eq, roots))
+        # у систем форма оформляется скобками
+        texts = [sp.latex(eq) for eq in sp.FiniteSet(*eqs)]
+        eq_text = r"\begin{cases}" + r"\\".join(texts) + r"\end{cases}"
+
+    # ответ по возможности считаем по готовой формуле, а семпай решает всё остальное
+    solution = template.solver(arguments) if template.solver else None
+    if solution is None:
+        solution = solve_with_sympy(template, eqs)
+    elif random.random() < CONFIG['solver']['cross_check']:
+        solution = cross_check(template, eqs, arguments, solution)
+
+    solution_text = sp.latex(solution)
+    form_len = form_width(eq_text)
+    root_count, root_type = describe_solution(solution)
+    return pool.Equation(eq_text, solution_text, form_len, len(solution_text), root_count, root_type,
+                         estimate_difficulty(form_len, root_count, root_type))
+
+
+def _solve_batch(path: str, mtime: int, batch: list[dict]) -> list[pool.Equation]:
+    """Решить пачку уравнений (выполняется в процессе движка, шаблон берётся из его собственного кэша)"""
+    template = compile_template(path, mtime)
+    return [make_equation(template, arguments) for arguments in batch]
+
+
+def solve_equations(template: CompiledTemplate, amount: int, rng: random.Random = random) -> list[pool.Equation]:
+    """Сгенерировать и решить amount уравнений по шаблону template"""
+    arguments = template.draw_valid_arguments(amount, rng)
+    with metrics.span('solve', template=template.label):
+        return solver.run_batches(_solve_batch, arguments, template.path, template.mtime)
+
+
+def _solve_indices(path: str, mtime: int, batch: list[int]) -> list[pool.Equation]:
+    """Решить пачку уравнений по номерам комбинаций аргументов (выполняется в процессе движка)"""
+    template = compile_template(path, mtime)
+    return [make_equation(template, template.arguments_at(index)) for index in batch]
+
+
+# решённые уравнения шаблонов с маленьким пространством аргументов: (путь, mtime, номер комбинации) -> уравнение
+_rendered: OrderedDict[tuple[str, int, int], pool.Equation] = OrderedDict()
+_rendered_lock = threading.Lock()
+
+
+def clear_rendered() -> None:
+    """Очистить кэш решённых уравнений маленьких шаблонов (для замеров на холодную)"""
+    with _rendered_lock:
+        _rendered.clear()
+
+
+def render_indices(template: CompiledTemplate, indices: list[int]) -> list[pool.Equation]:
+    """Решить уравнения с номерами комбинаций indices; недавно решённые берутся из LRU-кэша"""
+
+    keys = [(template.path, template.mtime, index) for index in indices]
+    found = {}
+    with _rendered_lock:
+        for key in keys:
+            if key in _rendered:
+                _rendered.move_to_end(key)
+                found[key] = _rendered[key]
+
+    missing = [key for key in keys if key not in found]
+    metrics.inc('eqgen_compact_cache_total', len(found), result='hit')
+    metrics.inc('eqgen_compact_cache_total', len(missing), result='miss')
+    if missing:
+        with metrics.span('solve', template=template.label):
+            solved = solver.run_batches(_solve_indices, [key[2] for key in missing], template.path, template.mtime)
+        with _rendered_lock:
+            for key, eq in zip(missing, solved):
+                _rendered[key] = found[key] = eq
+            while len(_rendered) > CONFIG['pool']['compact_cache_size']:
+                _rendered.popitem(last=False)
+
+    return [found[key] for key in keys]
+
+
+def sample_compact(template: CompiledTemplate, amount: int, filters: dict = None,
+                   rng: random.Random = random) -> list[pool.Equation]:
+    """Выбрать без повторов до amount уравнений шаблона с маленьким пространством аргументов
+
+    Случайно выбираются номера комбинаций аргументов, а решаются только выбранные. Повторяющиеся формы (разные
+    аргументы иногда дают одно и то же уравнение) и неподходящие под filters уравнения заменяются новыми, пока
+    не будет перебрано всё пространство или sampling.top_up_budget комбинаций; размер каждой пачки
+    рассчитывается по доле подошедших в предыдущих. При выборке с весами (см. sampling.weights) подходящих
+    набирается с запасом, и amount из них выбираются уже с весами."""
+
+    want = amount * sampling.WEIGHTED_OVERSAMPLE if sampling.weighted(filters) else amount
+    selected, forms, seen = [], set(), set()
+    limit = min(template.space_size, CONFIG['sampling']['top_up_budget'])
+    draw = want
+    while True:
+        indices = template.valid_indices(sampling.draw_indices(template.space_size, draw, seen, rng))
+        for eq in render_indices(template, indices):
+            if eq.form not in forms and sampling.matches(eq, filters) and len(selected) < want:
+                forms.add(eq.form)
+                selected.append(eq)
+        if len(selected) >= want or len(seen) >= limit:
+            return sampling.draw(selected, amount, sampling.weights(selected, filters), rng)
+        needed = sampling.candidates_needed(want - len(selected), len(seen), len(selected))
+        draw = min(needed, limit - len(seen))
+
+
+def refill_pool(eq_id: str) -> int:
+    """Дорешать уравнения в пул шаблона eq_id, если их там меньше нижней границы; вернуть кол-во новых"""
+
+    template = load_template(eq_id)
+
+    # маленьким шаблонам пул в БД не нужен (см. sample_compact), оставшиеся от прежних версий уравнения удаляем
+    if template.is_compact:
+        if pool.delete(eq_id):
+            logger.info(f"Dropped stored pool of compact template '{eq_id}'")
+        return 0
+
+    # в пуле хранятся только уникальные уравнения, поэтому у маленьких шаблонов граница ограничена их размером
+    target = min(CONFIG['pool']['low_water'], template.space_size)
+
+    # за один проход решаем не больше refill_batch уравнений, чтобы не занимать надолго процессор
+    eq_to_gen = min(target - pool.count(eq_id), CONFIG['pool']['refill_batch'])
+    if eq_to_gen <= 0:
+        return 0
+
+    return pool.add(eq_id, solve_equations(template, eq_to_gen))
+
+
+def refill_pools() -> None:
+    """Пополнить пулы всех базовых шаблонов (вызывается в фоне, вне обработки запросов пользователей)"""
+    for eq_id in basic_template_ids():
+        added = refill_pool(eq_id)
+        if added:
+            logger.info(f"Pool of template '{eq_id}' was refilled with {added} equations")
+
+
+def count_cols(equations: list[pool.Equation]) -> list[int]:
+    """Рассчитать кол-во столбцов для форм и решений выбранных уравнений (красивая разметка всё такое...)"""
+
+    max_form_length = max([1] + [eq.form_len for eq in equations])
+    max_solution_length = max([1] + [eq.solution_len for eq in equations])
+
+    return [min(round(100 / max_form_length), 5), min(round(100 / max_solution_length), 5)]
+
+
+def top_up(template: CompiledTemplate, eq_id: str, selected: list[pool.Equation], amount: int, from_pool: bool,
+           rng: random.Random = random, filters: dict = None) -> list[pool.Equation]:
+    """Дорешивать уравнения, пока различных (и подходящих под filters) не станет amount или пока не будет решено
+    sampling.top_up_budget уравнений; размер каждой пачки рассчитывается по доле подошедших в предыдущих"""
+
+    budget = CONFIG['sampling']['top_up_budget']
+    solved = gained = 0
+    while len(selected) < amount and solved < budget:
+        size = min(sampling.candidates_needed(amount - len(selected), solved, gained), budget - solved)
+        new_equations = solve_equations(template, size, rng)
+        solved += size
+        before = len(selected)
+        if from_pool:
+            # в пул идут все новые уравнения, а не только подходящие: они пригодятся другим заданиям
+            pool.add(eq_id, new_equations)
+            selected = pool.sample(eq_id, amount, filters)
         else:
-            # аналогично для систем, только форма оформляется скобками
-            eqs = [f.subs(arguments, simultaneous=True) for f in forms]
-            texts = []
-            for eq in sp.FiniteSet(*eqs):
-                t = sp.latex(eq)
-                if len(t) > max_form_length:
-                    max_form_length = len(t)
-                texts.append(t)
-            eq_text = r"\begin{cases}" + r"\\".join(texts) + r"\end{cases}"
-            solution = sp.latex(sp.nonlinsolve(eqs, roots))
-        if len(solution) > max_solution_length:
-            max_solution_length = len(solution)
-        generated_equations.append((eq_text, solution))
-
-    if not user_id:
-        # пихаем созданные ур-я в БД, объединяем новые и существующие в единый список
-        with con:
-            con.executemany(f'INSERT INTO {eq_id} VALUES(?, ?)', generated_equations)
-        all_equations = generated_equations + equations_in_db
-
-        selected_equations = []
-        hashes = []
-        count = 0
-
-        # производим рандомную выборку требуемого кол-ва уравнений из общего списка, исключая повторы с помощью хэшей
-        while count != amount:
-            eq = random.choice(all_equations)
-            if hash(eq[0]) in hashes:
-                continue
-            hashes.append(hash(eq[0]))
-            selected_equations.append(eq)
-            count += 1
+            candidates = sampling.distinct(selected + [eq for eq in new_equations if sampling.matches(eq, filters)])
+            selected = sampling.draw(candidates, amount, sampling.weights(candidates, filters), rng)
+        gained += len(selected) - before
+    return selected
+
+
+def make_equations(eq_id: str, amount: int, user_id: str = None, policy: str = None,
+                   rng: random.Random = None, filters: dict = None) -> dict:
+    """Создать уравнения в количестве amount по заданному в eq_id шаблону
+
+    policy определяет, что делать, если различных уравнений не хватает (см. gen.sampling); в результате
+    под ключом 'repeated' указывается, сколько уравнений пришлось повторить. Если передан rng (с заданным
+    сидом), уравнения не выбираются из пула, а генерируются им заново, так что результат определяется сидом.
+    filters отбирают уравнения по метаданным (см. gen.sampling.FILTER_KEYS)."""
+
+    template = load_template(eq_id, user_id)
+    policy = policy or CONFIG['sampling']['policy']
+    from_pool = not user_id and rng is None
+    compact = from_pool and template.is_compact
+    rng = rng or random
+
+    if compact:
+        # у маленьких шаблонов пул - это само пространство аргументов, решаются только выбранные комбинации
+        selected_equations = sample_compact(template, amount, filters, rng)
+    elif from_pool:
+        # базовые шаблоны берём из пула, который пополняется в фоне (см. refill_pools);
+        # выборка без повторов делается прямо в БД, так что в память попадают только выбранные уравнения
+        selected_equations = pool.sample(eq_id, amount, filters)
     else:
-        selected_equations = generated_equations  # для кастомных ничего не меняется, отправляем все созданные ур-я
+        # если шаблон кастомный (или задан сид), генерируем ровно столько, сколько требуется, отсеивая повторы
+        # (при выборке с весами - с запасом, чтобы было из чего выбирать)
+        want = amount * sampling.WEIGHTED_OVERSAMPLE if sampling.weighted(filters) else amount
+        candidates = [eq for eq in sampling.distinct(solve_equations(template, want, rng))
+                      if sampling.matches(eq, filters)]
+        selected_equations = candidates
+        if sampling.weighted(filters):
+            selected_equations = sampling.draw(candidates, amount, sampling.weights(candidates, filters), rng)
+
+    # семпай здесь запускается только тогда, когда различных уравнений не хватило
+    # (например, пул ещё не успел наполниться или у шаблона слишком узкие диапазоны аргументов)
+    if len(selected_equations) < amount and policy == sampling.TOP_UP and not compact:
+        selected_equations = top_up(template, eq_id, selected_equations, amount, from_pool, rng, filters)
+
+    repeated = amount - len(selected_equations)
+    if repeated:
+        if policy == sampling.FAIL or not selected_equations:
+            raise sampling.PoolExhausted(eq_id, len(selected_equations), amount)
+        logger.warning(f"Template '{eq_id}' ran out of distinct equations, {repeated} of {amount} are repeated")
+        selected_equations += rng.choices(selected_equations, k=repeated)
+
+    if filters and filters.get('sort') == 'difficulty':
+        selected_equations.sort(key=lambda eq: eq.difficulty or 0)
 
     return {'equations': selected_equations,
-            'cols': [min(round(100 / max_form_length), 5), min(round(100 / max_solution_length), 5)],
-            'description': conf['description']}
+            'cols': count_cols(selected_equations),
+            'description': template.description,
+            'repeated': repeated}
@@ -0,0 +1,142 @@
+"""Проверка загруженных пользователями шаблонов в отдельном процессе с ограничениями по времени и памяти
+
+Бот запускает python -m gen.validation путь/к/шаблону.yaml; процесс сам ограничивает себе процессорное время и память,
+проверяет шаблон по схеме, разбирает формы семпаем и пробно решает несколько уравнений, замеряя время на каждое.
+Результат печатается последней строкой в JSON. Зависший или раздувшийся процесс бот просто убивает, так что
+даже злонамеренный шаблон не остановит обработку запросов остальных пользователей."""
+
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import signal
+import resource
+from typing import NamedTuple
+
+from . import CONFIG, metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = "data/equations/schema.yaml"
+
+# формы и условия разбирает sympify (по сути eval), поэтому в них допускаются только имена, числа и операторы
+FORM_PATTERN = re.compile(r"[A-Za-z0-9 +\-*/^().,=]+")
+CONDITION_PATTERN = re.compile(r"[A-Za-z0-9 +\-*/^().,=<>!]+")
+
+# причины отказа, при которых шаблон корректен, но решается слишком долго
+TOO_SLOW = ('budget', 'timeout', 'limits')
+
+# сигналы, которыми ядро завершает процесс проверки, превысивший лимит процессорного времени
+# (SIGXCPU - мягкий предел RLIMIT_CPU, SIGKILL - жёсткий)
+LIMIT_SIGNALS = (signal.SIGXCPU, signal.SIGKILL)
+
+
+class Verdict(NamedTuple):
+    """Итог проверки шаблона"""
+    ok: bool
+    reason: str | None  # schema, form, solve, budget, timeout, limits, error (None - шаблон принят)
+    seconds: float | None  # среднее время решения одного уравнения при пробном решении
+    error: str | None = None
+
+
+# --- сторона проверяющего процесса ---
+
+def _limit_resources() -> None:
+    """Ограничить процессорное время и адресное пространство текущего процесса"""
+    cpu = CONFIG['validation']['cpu_seconds']
+    memory = CONFIG['validation']['memory_mb'] * 2 ** 20
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+def check(path: str) -> Verdict:
+    """Проверить шаблон по пути path (выполняется уже в ограниченном процессе)"""
+
+    import yamale
+    from .templates import CompiledTemplate, make_equation
+
+    stage = 'schema'
+    try:
+        data = yamale.make_data(path)  # безопасный загрузчик: теги вроде !!python/object шаблон не пройдут
+        yamale.validate(yamale.make_schema(SCHEMA_PATH), data)
+        conf = data[0][0]
+
+        stage = 'form'
+        for form in conf['form']:
+            if not FORM_PATTERN.fullmatch(form) or '__' in form or form.count('=') != 1:
+                raise ValueError(f"Form '{form}' is not allowed")
+        for condition in conf.get('valid', []):
+            if not CONDITION_PATTERN.fullmatch(condition) or '__' in condition:
+                raise ValueError(f"Condition '{condition}' is not allowed")
+        template = CompiledTemplate(conf, path, 0)
+        if template.space_size == 0:
+            raise ValueError("Arguments have no values")
+        trials = template.draw_valid_arguments(CONFIG['validation']['trial_equations'])
+        if not trials:
+            raise ValueError("No arguments satisfy the template conditions")
+
+        stage = 'solve'
+        seconds = []
+        for arguments in trials:
+            t = time.perf_counter()
+            make_equation(template, arguments)
+            seconds.append(time.perf_counter() - t)
+    except MemoryError:
+        return Verdict(False, 'limits', None, 'out of memory')
+    except Exception as e:
+        return Verdict(False, stage, None, repr(e))
+
+    mean = sum(seconds) / len(seconds)
+    if mean > CONFIG['validation']['budget']:
+        return Verdict(False, 'budget', mean)
+    return Verdict(True, None, mean)
+
+
+def main() -> int:
+    _limit_resources()  # до импорта семпая, чтобы ограничения касались всего, что делает процесс
+    print(json.dumps(check(sys.argv[1])._asdict()))
+    return 0
+
+
+# --- сторона бота ---
+
+async def validate_template(path: str) -> Verdict:
+    """Проверить шаблон в отдельном процессе, не блокируя бота; зависший процесс убивается по таймауту"""
+
+    with metrics.span('template_validation'):
+        verdict = await _run_check(str(path))
+    metrics.inc('eqgen_template_validation_total', result=verdict.reason or 'ok')
+    logger.info(f"Template {path} validation: {verdict}")
+    return verdict
+
+
+async def _run_check(path: str) -> Verdict:
+    process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'gen.validation', path,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), CONFIG['validation']['timeout'])
+    except asyncio.TimeoutError:
+        return Verdict(False, 'timeout', None)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    # процесс, убитый за превышение лимитов (сигналом или нехваткой памяти вне самой проверки, например при импорте
+    # семпая), - это слишком тяжёлый шаблон; любое другое падение без ответа - ошибка самой проверки
+    lines = stdout.decode('utf-8').splitlines()
+    if process.returncode != 0 or not lines:
+        errors = stderr.decode('utf-8', 'replace').strip().splitlines()
+        error = errors[-1] if errors else f"exit code {process.returncode}"
+        if -process.returncode in LIMIT_SIGNALS or error.startswith('MemoryError'):
+            return Verdict(False, 'limits', None, error)
+        logger.error(f"Template validation process failed with exit code {process.returncode}: {error}")
+        return Verdict(False, 'error', None, error)
+    return Verdict(**json.loads(lines[-1]))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Воркер генерации работ: берёт работы из очереди в БД (gen.jobs) и публикует готовые pdf обратно
+
+Запуск: python -m gen.worker [--jobs 2]
+
+Воркеров можно запускать сколько угодно, в том числе на других машинах с общей папкой data. Каждый воркер
+поднимает свой пул процессов для решения уравнений и сам пополняет пулы заранее решённых уравнений."""
+
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from contextlib import aclosing
+
+from . import CONFIG, solver, pool, jobs, templates, workspace
+from .task import Result, stream
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 2  # как часто отмечаться в работе и проверять, не отменили ли её (в секундах)
+CLEANUP_INTERVAL = 10  # как часто убирать отменённые и брошенные работы (в секундах)
+
+
+async def run_job(job_id: int, user_id: str, task: dict) -> None:
+    """Сгенерировать работу, публикуя каждый pdf сразу по готовности"""
+
+    result = Result()
+    async with aclosing(stream(task, user_id, result)) as pdfs:
+        async for filename, data in pdfs:
+            await asyncio.to_thread(jobs.publish, job_id, filename, data)
+    await asyncio.to_thread(jobs.finish, job_id, result)
+
+
+async def watch_job(job_id: int, user_id: str, task: dict) -> None:
+    """Выполнить работу, останавливая её, если бот её отменил"""
+
+    logger.info(f"Job {job_id} of user (id = {user_id}) has been claimed")
+    running = asyncio.create_task(run_job(job_id, user_id, task))
+    try:
+        while True:
+            done, _ = await asyncio.wait([running], timeout=HEARTBEAT_INTERVAL)
+            if done:
+                running.result()
+                logger.info(f"Job {job_id} is done")
+                return
+            await asyncio.to_thread(jobs.heartbeat, job_id)
+    except jobs.JobCancelled:
+        logger.info(f"Job {job_id} was cancelled")
+    except asyncio.CancelledError:  # воркер останавливают - бот сразу узнает, что работы не будет
+        await asyncio.to_thread(jobs.fail, job_id, RuntimeError('worker stopped'))
+        raise
+    except Exception as e:
+        logger.exception(f"Job {job_id} failed")
+        await asyncio.to_thread(jobs.fail, job_id, e)
+    finally:
+        running.cancel()
+        await asyncio.gather(running, return_exceptions=True)
+
+
+async def refill_pools() -> None:
+    """Фоновое пополнение пулов уравнений (в режиме очереди этим занимаются воркеры, а не бот)"""
+    while True:
+        await asyncio.to_thread(templates.refill_pools)
+        await asyncio.sleep(CONFIG['pool']['refill_interval'])
+
+
+async def serve(concurrency: int) -> None:
+    """Брать работы из очереди, выполняя не больше concurrency работ одновременно"""
+
+    name = jobs.worker_name()
+    slots = asyncio.Semaphore(concurrency)
+    running: set[asyncio.Task] = set()
+    refill = asyncio.create_task(refill_pools())
+    logger.info(f"Worker {name} is waiting for jobs (concurrency = {concurrency})")
+
+    cleaned = 0
+    try:
+        while True:
+            await slots.acquire()
+            if time.monotonic() - cleaned > CLEANUP_INTERVAL:
+                await asyncio.to_thread(jobs.cleanup)
+                await asyncio.to_thread(workspace.collect)
+                cleaned = time.monotonic()
+            claimed = await asyncio.to_thread(jobs.claim, name)
+            if claimed is None:
+                slots.release()
+                await asyncio.sleep(CONFIG['workers']['poll_interval'])
+                continue
+
+            t = asyncio.create_task(watch_job(*claimed))
+            running.add(t)
+            t.add_done_callback(running.discard)
+            t.add_done_callback(lambda _: slots.release())
+    finally:
+        refill.cancel()
+        for t in running:
+            t.cancel()
+        await asyncio.gather(refill, *running, return_exceptions=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m gen.worker', description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=CONFIG['workers']['jobs'], help='работ одновременно')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    solver.start()
+    try:
+        asyncio.run(serve(args.jobs))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        solver.shutdown()
+        pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Рабочие папки компиляции и сборка мусора: брошенные папки и неиспользуемые пользовательские шаблоны
+
+У каждой компиляции своя папка eqgen_{pid}_{...} в latex.workdir (лучше на tmpfs), так что параллельные работы,
+в том числе одного пользователя, не пересекаются. Папка удаляется в два шага: сначала атомарно переименовывается
+в eqgen_trash_{...}, потом стирается, - так наполовину удалённая папка никогда не выглядит рабочей. Если процесс
+упал, его папки и недочищенный мусор подбирает collect."""
+
+import os
+import re
+import time
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+from . import CONFIG
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'eqgen_'
+TRASH_PREFIX = 'eqgen_trash_'
+# рабочая папка - ровно eqgen_{pid}_{...}: чужие папки с тем же префиксом (например, eqgen_bench_ бенчмарка) не трогаем
+WORKSPACE_PATTERN = re.compile(rf'{PREFIX}(\d+)_')
+CUSTOM_DIR = Path("data/equations/custom")
+
+
+def root() -> Path:
+    """Папка, в которой создаются рабочие папки (создаётся при необходимости)"""
+    path = Path(CONFIG['latex']['workdir'] or tempfile.gettempdir())
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def remove(path: Path) -> None:
+    """Атомарно убрать папку из рабочих и стереть её"""
+    trash = path.with_name(TRASH_PREFIX + path.name.removeprefix(PREFIX))
+    try:
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+@contextmanager
+def workspace() -> Path:
+    """Создать уникальную рабочую папку на время блока with"""
+    path = Path(tempfile.mkdtemp(prefix=f'{PREFIX}{os.getpid()}_', dir=root()))
+    try:
+        yield path
+    finally:
+        remove(path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # процесс есть, но чужой
+        return True
+    return True
+
+
+def collect() -> int:
+    """Стереть недочищенный мусор и рабочие папки завершившихся процессов (и слишком старые - на случай,
+    если айди процесса уже занял другой); вернуть количество убранных папок"""
+
+    stale = time.time() - CONFIG['workspace']['max_age']
+    removed = 0
+    for path in root().glob(f'{PREFIX}*'):
+        try:
+            if not path.is_dir():
+                continue
+            if path.name.startswith(TRASH_PREFIX):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                match = WORKSPACE_PATTERN.match(path.name)
+                if match is None:
+                    continue
+                if _alive(int(match[1])) and path.stat().st_mtime > stale:
+                    continue
+                remove(path)
+        except FileNotFoundError:  # папку только что убрал её же процесс
+            continue
+        removed += 1
+
+    if removed:
+        logger.info(f"Collected {removed} orphaned workspaces in {root()}")
+    return removed
+
+
+def collect_custom(referenced: set[tuple[str, str]]) -> int:
+    """Удалить пользовательские шаблоны, на которые не ссылается ни одна работа (пары (user_id, айди шаблона))
+
+    Неиспользуемые шаблоны живут ещё workspace.custom_grace секунд (пользователь мог только что загрузить шаблон
+    и ещё вводить его название). Если все шаблоны вместе занимают больше workspace.custom_max_bytes, неиспользуемые
+    удаляются сразу, от самых старых; используемые не удаляются никогда. Вернуть количество удалённых шаблонов."""
+
+    if not CUSTOM_DIR.exists():
+        return 0
+
+    unused = []
+    total = 0
+    for path in CUSTOM_DIR.glob('*/*.yaml'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        total += stat.st_size
+        if (path.parent.name, path.stem) not in referenced:
+            unused.append((stat.st_mtime, stat.st_size, path))
+
+    grace = time.time() - CONFIG['workspace']['custom_grace']
+    removed = 0
+    for mtime, size, path in sorted(unused):  # старые раньше новых
+        if total <= CONFIG['workspace']['custom_max_bytes'] and mtime > grace:
+            continue
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+
+    if total > CONFIG['workspace']['custom_max_bytes']:
+        logger.warning(f"Custom templates still used by tasks take {total} bytes, "
+                       f"more than {CONFIG['workspace']['custom_max_bytes']}")
+    if removed:
+        logger.info(f"Collected {removed} custom templates ({total} bytes left)")
+    return removed
@@ -3,9 +3,14 @@
 
 """Входная точка приложения, запускающая телеграм-бота и необходимые модули вместе с ним."""
 
+# первым делом - отсчёт времени запуска (генерация загружается уже после него в фоне, см. bot.startup)
+from bot import startup
+
+import asyncio
 import logging
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, filters, MessageHandler,\
-    CallbackQueryHandler, ConversationHandler, ContextTypes
+    CallbackQueryHandler, ConversationHandler, ContextTypes, TypeHandler
 
 from bot.main_menu import variants, name, description, variants_input, name_input, description_input, generate, \
     ready_warning, main_menu_handler
@@ -18,76 +23,138 @@ from bot.equations_menu import equations_menu_handler, equations_upload, equatio
 
 from bot.common_handlers import begin, start, about, error_handler, delete_fallback_messages, cancel
 
-from bot.util import CustomContext
+from bot.util import CustomContext, refill_pools, write_metrics, stop_generation, record_update, webhook_secret, \
+    collect_garbage
+from bot.persistence import SQLitePersistence
+
+from gen import CONFIG, metrics
 
 from bot import *
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    filemode='w',
-    filename='data/application.log'
-)
 logger = logging.getLogger(__name__)
 
-context_types = ContextTypes(context=CustomContext)
-
-application = ApplicationBuilder().token(open('data/token.txt', 'r').read()).context_types(
-    context_types).concurrent_updates(True).build()
-
-start_handler = CommandHandler(['start', 'help'], start)
-about_handler = CommandHandler('about', about)
-
-# entry_points - запускает меню генерации
-# states - "состояния", при нахождении в которых обрабатываются (ожидаются) лишь указанные хэндлеры
-# fallbacks - хэндлеры, которые обрабатываются, если ни один из других хэндлеров не прокатил
-
-generate_handler = ConversationHandler(
-    entry_points=[CommandHandler("generate", begin)],
-    states={
-        VARIANTS_INPUT: [MessageHandler(filters.TEXT, variants_input)],
-        NAME_INPUT: [MessageHandler(filters.TEXT, name_input)],
-        DESCRIPTION_INPUT: [MessageHandler(filters.TEXT, description_input)],
-        EXAMPLES_EDIT_INPUT: [MessageHandler(filters.TEXT, examples_edit_input)],
-        EQUATIONS_UPLOAD_INPUT: [MessageHandler(filters.ATTACHMENT, equations_upload_input),
-                                 CommandHandler("cancel_upload", cancel_upload)],
-        EQUATIONS_UPLOAD_INPUT_2: [CommandHandler("cancel_upload", cancel_upload),
-                                   MessageHandler(filters.TEXT, equations_upload_input_2)],
-        MAIN_MENU: [
-            CallbackQueryHandler(name, pattern="^" + str(NAME) + "$"),
-            CallbackQueryHandler(description, pattern="^" + str(DESCRIPTION) + "$"),
-            CallbackQueryHandler(variants, pattern="^" + str(VARIANTS) + "$"),
-            CallbackQueryHandler(examples_menu_handler, pattern="^" + str(EXAMPLES) + "$"),
-            CallbackQueryHandler(generate, pattern="^" + str(CREATE) + "$"),
-            CallbackQueryHandler(ready_warning, pattern="^" + str(READY_WARNING) + "$")
-        ],
-        EXAMPLES_MENU: [
-            CallbackQueryHandler(equations_menu_handler, pattern="^" + str(EXAMPLES_ADD) + "$"),
-            CallbackQueryHandler(examples_remove, pattern="^" + str(EXAMPLES_REMOVE) + "$"),
-            CallbackQueryHandler(examples_edit, pattern="^" + str(EXAMPLES_EDIT) + "$"),
-            CallbackQueryHandler(examples_next, pattern="^" + str(EXAMPLES_NEXT) + "$"),
-            CallbackQueryHandler(examples_previous, pattern="^" + str(EXAMPLES_PREVIOUS) + "$"),
-            CallbackQueryHandler(main_menu_handler, pattern="^" + str(EXAMPLES_BACK_TO_MAIN) + "$")
-        ],
-        EQUATIONS_MENU: [
-            CallbackQueryHandler(equations_select(0), pattern="^" + str(EQUATIONS_SELECT_1) + "$"),
-            CallbackQueryHandler(equations_select(1), pattern="^" + str(EQUATIONS_SELECT_2) + "$"),
-            CallbackQueryHandler(equations_select(2), pattern="^" + str(EQUATIONS_SELECT_3) + "$"),
-            CallbackQueryHandler(equations_select(3), pattern="^" + str(EQUATIONS_SELECT_4) + "$"),
-            CallbackQueryHandler(equations_next, pattern="^" + str(EQUATIONS_NEXT) + "$"),
-            CallbackQueryHandler(equations_previous, pattern="^" + str(EQUATIONS_PREVIOUS) + "$"),
-            CallbackQueryHandler(equations_upload, pattern="^" + str(EQUATIONS_UPLOAD) + "$"),
-            CallbackQueryHandler(examples_menu_handler, pattern="^" + str(EQUATIONS_BACK_TO_EX) + "$"),
-        ],
-    },
-    fallbacks=[CommandHandler("cancel", cancel),
-               MessageHandler(filters.ALL, delete_fallback_messages)]
-)
-
-application.add_handler(start_handler)
-application.add_handler(about_handler)
-application.add_handler(generate_handler)
-
-application.add_error_handler(error_handler)
-
-application.run_polling()
\ No newline at end of file
+
+def main() -> None:
+    """Собрать и запустить бота
+
+    Всё это делается в функции, а не при импорте модуля: процессы решателя запускаются не форком
+    (см. solver.start_method) и импортируют главный модуль заново, а им бот не нужен."""
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        filemode='w',
+        filename='data/application.log'
+    )
+
+    context_types = ContextTypes(context=CustomContext)
+
+    # состояние диалогов и user_data переживают перезапуск бота (изменения пишутся в БД пачками)
+    persistence = SQLitePersistence(CONFIG['persistence']['path'], CONFIG['persistence']['update_interval'])
+
+    # очередь полученных, но ещё не обработанных обновлений ограничена: при перегрузке вебхук перестаёт
+    # их принимать, и телеграм присылает их позже, а не копит бот в памяти
+    builder = ApplicationBuilder().token(open('data/token.txt', 'r').read()).context_types(
+        context_types).concurrent_updates(True).persistence(persistence).post_shutdown(
+        stop_generation).update_queue(asyncio.Queue(CONFIG['telegram']['update_queue_size']))
+
+    # после запуска: замеры времени хэндлеров и задержки цикла событий (см. bot.monitor) и фоновая загрузка
+    # генерации вместе с процессами решателя (см. bot.startup)
+    builder = builder.post_init(startup.post_init)
+
+    # другой адрес Bot API - например, локальная заглушка bot.standin
+    if CONFIG['telegram']['base_url']:
+        builder = builder.base_url(CONFIG['telegram']['base_url']).base_file_url(
+            CONFIG['telegram']['base_file_url'])
+
+    application = builder.build()
+
+    start_handler = CommandHandler(['start', 'help'], start)
+    about_handler = CommandHandler('about', about)
+
+    # entry_points - запускает меню генерации
+    # states - "состояния", при нахождении в которых обрабатываются (ожидаются) лишь указанные хэндлеры
+    # fallbacks - хэндлеры, которые обрабатываются, если ни один из других хэндлеров не прокатил
+
+    generate_handler = ConversationHandler(
+        name='generate',
+        persistent=True,
+        entry_points=[CommandHandler("generate", begin)],
+        states={
+            VARIANTS_INPUT: [MessageHandler(filters.TEXT, variants_input)],
+            NAME_INPUT: [MessageHandler(filters.TEXT, name_input)],
+            DESCRIPTION_INPUT: [MessageHandler(filters.TEXT, description_input)],
+            EXAMPLES_EDIT_INPUT: [MessageHandler(filters.TEXT, examples_edit_input)],
+            EQUATIONS_UPLOAD_INPUT: [MessageHandler(filters.ATTACHMENT, equations_upload_input),
+                                     CommandHandler("cancel_upload", cancel_upload)],
+            EQUATIONS_UPLOAD_INPUT_2: [CommandHandler("cancel_upload", cancel_upload),
+                                       MessageHandler(filters.TEXT, equations_upload_input_2)],
+            MAIN_MENU: [
+                CallbackQueryHandler(name, pattern="^" + str(NAME) + "$"),
+                CallbackQueryHandler(description, pattern="^" + str(DESCRIPTION) + "$"),
+                CallbackQueryHandler(variants, pattern="^" + str(VARIANTS) + "$"),
+                CallbackQueryHandler(examples_menu_handler, pattern="^" + str(EXAMPLES) + "$"),
+                CallbackQueryHandler(generate, pattern="^" + str(CREATE) + "$"),
+                CallbackQueryHandler(ready_warning, pattern="^" + str(READY_WARNING) + "$")
+            ],
+            EXAMPLES_MENU: [
+                CallbackQueryHandler(equations_menu_handler, pattern="^" + str(EXAMPLES_ADD) + "$"),
+                CallbackQueryHandler(examples_remove, pattern="^" + str(EXAMPLES_REMOVE) + "$"),
+                CallbackQueryHandler(examples_edit, pattern="^" + str(EXAMPLES_EDIT) + "$"),
+                CallbackQueryHandler(examples_next, pattern="^" + str(EXAMPLES_NEXT) + "$"),
+                CallbackQueryHandler(examples_previous, pattern="^" + str(EXAMPLES_PREVIOUS) + "$"),
+                CallbackQueryHandler(main_menu_handler, pattern="^" + str(EXAMPLES_BACK_TO_MAIN) + "$")
+            ],
+            EQUATIONS_MENU: [
+                CallbackQueryHandler(equations_select(0), pattern="^" + str(EQUATIONS_SELECT_1) + "$"),
+                CallbackQueryHandler(equations_select(1), pattern="^" + str(EQUATIONS_SELECT_2) + "$"),
+                CallbackQueryHandler(equations_select(2), pattern="^" + str(EQUATIONS_SELECT_3) + "$"),
+                CallbackQueryHandler(equations_select(3), pattern="^" + str(EQUATIONS_SELECT_4) + "$"),
+                CallbackQueryHandler(equations_next, pattern="^" + str(EQUATIONS_NEXT) + "$"),
+                CallbackQueryHandler(equations_previous, pattern="^" + str(EQUATIONS_PREVIOUS) + "$"),
+                CallbackQueryHandler(equations_upload, pattern="^" + str(EQUATIONS_UPLOAD) + "$"),
+                CallbackQueryHandler(examples_menu_handler, pattern="^" + str(EQUATIONS_BACK_TO_EX) + "$"),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel),
+                   MessageHandler(filters.ALL, delete_fallback_messages)]
+    )
+
+    # запись всех входящих обновлений (группа -1 обрабатывается раньше остальных и не мешает им)
+    if CONFIG['telegram']['record_updates']:
+        application.add_handler(TypeHandler(Update, record_update), group=-1)
+
+    application.add_handler(start_handler)
+    application.add_handler(about_handler)
+    application.add_handler(generate_handler)
+
+    application.add_error_handler(error_handler)
+
+    # фоновое пополнение пулов уравнений, чтобы при генерации работ оставалось лишь выбрать готовые из БД
+    # (если работы генерируют внешние воркеры, пулы пополняют они же)
+    if not CONFIG['workers']['queue']:
+        application.job_queue.run_repeating(refill_pools, interval=CONFIG['pool']['refill_interval'], first=0)
+
+    # брошенные упавшими процессами рабочие папки и ненужные пользовательские шаблоны
+    application.job_queue.run_repeating(collect_garbage, interval=CONFIG['workspace']['gc_interval'], first=0)
+
+    # метрики этапов генерации: периодически пишем в файл и, если задан порт, отдаём по HTTP
+    if CONFIG['metrics']['file']:
+        application.job_queue.run_repeating(write_metrics, interval=CONFIG['metrics']['interval'])
+    if CONFIG['metrics']['port']:
+        metrics.serve(CONFIG['metrics']['port'])
+
+    # оба режима сами обрабатывают SIGINT/SIGTERM: перестают принимать обновления, дообрабатывают уже
+    # полученные и только потом вызывают post_shutdown (остановка решателя, закрытие БД)
+    if CONFIG['telegram']['mode'] == 'webhook':
+        webhook = CONFIG['telegram']['webhook']
+        application.run_webhook(listen=webhook['listen'], port=webhook['port'], url_path=webhook['url_path'],
+                                webhook_url=webhook['url'],
+                                secret_token=webhook_secret(webhook['secret_token_file']),
+                                max_connections=webhook['max_connections'])
+    else:
+        application.run_polling()
+
+
+if __name__ == '__main__':
+    main()